@@ -0,0 +1,168 @@
+""" Precomputed sales rollups kept in the SalesRollups collection
+
+Each rollup document holds the order count and revenue for one key of one dimension: a day,
+a book, a genre, a publisher or an order status (status rollups only count orders). Placing
+orders and changing their status update the rollups with $inc, so the admin dashboard reads a
+few small, indexed documents no matter how many orders exist. rebuild_sales() recomputes them
+from Orders joined to Books, for existing data or after a bulk import.
+"""
+import logging
+
+from pymongo import DESCENDING, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+ROLLUPS = "SalesRollups"
+
+# Tries at an upsert that lost a duplicate-key race to a concurrent insert of the same new rollup
+UPSERT_ATTEMPTS = 3
+
+DAY = "day"
+BOOK = "book"
+GENRE = "genre"
+PUBLISHER = "publisher"
+STATUS = "status"
+
+# Dimensions whose rollups are rebuilt from the per-book totals
+BOOK_FIELD_DIMENSIONS = {GENRE: "genre", PUBLISHER: "publisher"}
+
+# Catalog fields copied onto book rollups so reports survive book deletion
+BOOK_ROLLUP_FIELDS = {"_id": 0, "BookID": 1, "title": 1, "genre": 1, "publisher": 1}
+
+UNKNOWN = "Unknown"
+
+logger = logging.getLogger("bookstore.analytics")
+
+def _add(totals, dimension, key, orders, revenue=0.0):
+    """ Accumulate orders and revenue for one rollup key """
+    total = totals.setdefault((dimension, key), {"Orders": 0, "Revenue": 0.0})
+    total['Orders'] += orders
+    total['Revenue'] += revenue
+
+def _book_details(db, book_ids):
+    """ Return a BookID -> title, genre and publisher map in a single query """
+    return {
+        book['BookID']: book
+        for book in db["Books"].find({"BookID": {"$in": list(book_ids)}}, BOOK_ROLLUP_FIELDS)
+    }
+
+def _write_rollups(db, requests):
+    """ Bulk-write rollup upserts, retrying those that raced another insert of the same rollup """
+    for attempt in range(UPSERT_ATTEMPTS):
+        try:
+            db[ROLLUPS].bulk_write(requests, ordered=False)
+            return
+        except BulkWriteError as error:
+            write_errors = error.details['writeErrors']
+            if attempt + 1 == UPSERT_ATTEMPTS or any(write_error['code'] != 11000 for write_error in write_errors):
+                raise
+            # The other writes were applied; on retry the losers find the rollup and update it
+            requests = [requests[write_error['index']] for write_error in write_errors]
+
+def _update_rollups(db, build_requests, description):
+    """ Apply the rollup updates for orders that are already stored, logging rather than raising
+
+    The orders stand either way, and rebuild_sales() repairs rollups that missed an update.
+    """
+    try:
+        requests = build_requests()
+        if requests:
+            _write_rollups(db, requests)
+    except PyMongoError:
+        logger.exception("Updating sales rollups for %s failed; rebuild them to repair the totals", description)
+
+def record_sales(db, orders):
+    """ Fold newly placed orders into the rollups with one bulk write """
+    if orders:
+        _update_rollups(db, lambda: _sales_requests(db, orders), f"{len(orders)} new orders")
+
+def _sales_requests(db, orders):
+    """ Build the rollup upserts that add the given orders """
+    books = _book_details(db, {order['BookID'] for order in orders})
+    totals = {}
+    for order in orders:
+        book = books.get(order['BookID'], {})
+        price = order.get('Price') or 0
+        _add(totals, DAY, order['OrderDate'], 1, price)
+        _add(totals, BOOK, order['BookID'], 1, price)
+        for dimension, field in BOOK_FIELD_DIMENSIONS.items():
+            _add(totals, dimension, book.get(field) or UNKNOWN, 1, price)
+        _add(totals, STATUS, order['OrderStatus'], 1)
+
+    requests = []
+    for (dimension, key), total in totals.items():
+        update = {"$inc": total}
+        if dimension == BOOK and key in books:
+            update["$set"] = {"Title": books[key].get('title', UNKNOWN)}
+        requests.append(UpdateOne({"Dimension": dimension, "Key": key}, update, upsert=True))
+    return requests
+
+def record_status_change(db, moved, new_status):
+    """ Move order counts between status rollups, given an old status -> orders map """
+    _update_rollups(db, lambda: _status_requests(moved, new_status), f"orders moved to {new_status}")
+
+def _status_requests(moved, new_status):
+    """ Build the rollup upserts that move order counts to the new status """
+    requests = [
+        UpdateOne({"Dimension": STATUS, "Key": status},
+                  {"$inc": {"Orders": -count}, "$setOnInsert": {"Revenue": 0.0}}, upsert=True)
+        for status, count in moved.items() if count and status != new_status
+    ]
+    total = sum(count for status, count in moved.items() if status != new_status)
+    if total:
+        requests.append(UpdateOne({"Dimension": STATUS, "Key": new_status},
+                                  {"$inc": {"Orders": total}, "$setOnInsert": {"Revenue": 0.0}}, upsert=True))
+    return requests if total else []
+
+def rebuild_sales(db):
+    """ Recompute every rollup from Orders joined to Books and return how many were written """
+    totals = {}
+    for row in db["Orders"].aggregate([{"$group": {"_id": "$OrderDate", "orders": {"$sum": 1},
+                                                   "revenue": {"$sum": "$Price"}}}]):
+        _add(totals, DAY, row['_id'], row['orders'], row['revenue'])
+    for row in db["Orders"].aggregate([{"$group": {"_id": "$OrderStatus", "orders": {"$sum": 1}}}]):
+        _add(totals, STATUS, row['_id'], row['orders'])
+
+    # Group by book first, so the join with Books runs once per book rather than once per order
+    titles = {}
+    by_book = db["Orders"].aggregate([
+        {"$group": {"_id": "$BookID", "orders": {"$sum": 1}, "revenue": {"$sum": "$Price"}}},
+        {"$lookup": {"from": "Books", "localField": "_id", "foreignField": "BookID", "as": "book"}},
+        {"$project": {"orders": 1, "revenue": 1, "book": {"$arrayElemAt": ["$book", 0]}}}
+    ])
+    for row in by_book:
+        book = row.get('book') or {}
+        _add(totals, BOOK, row['_id'], row['orders'], row['revenue'])
+        titles[row['_id']] = book.get('title', UNKNOWN)
+        for dimension, field in BOOK_FIELD_DIMENSIONS.items():
+            _add(totals, dimension, book.get(field) or UNKNOWN, row['orders'], row['revenue'])
+
+    requests = []
+    for (dimension, key), total in totals.items():
+        rollup = dict(total, Dimension=dimension, Key=key)
+        if dimension == BOOK:
+            rollup['Title'] = titles[key]
+        requests.append(ReplaceOne({"Dimension": dimension, "Key": key}, rollup, upsert=True))
+    if requests:
+        _write_rollups(db, requests)
+    for dimension in (DAY, BOOK, GENRE, PUBLISHER, STATUS):
+        keys = [key for rollup_dimension, key in totals if rollup_dimension == dimension]
+        db[ROLLUPS].delete_many({"Dimension": dimension, "Key": {"$nin": keys}})
+    return len(totals)
+
+def revenue_by_day(db, days=30):
+    """ Return the rollups of the latest days that had orders, oldest first """
+    rollups = list(db[ROLLUPS].find({"Dimension": DAY}, {"_id": 0}).sort("Key", DESCENDING).limit(days))
+    return rollups[::-1]
+
+def top_sales(db, dimension, limit=10):
+    """ Return the highest-revenue rollups of a dimension """
+    return list(db[ROLLUPS].find({"Dimension": dimension}, {"_id": 0}).sort("Revenue", DESCENDING).limit(limit))
+
+def orders_by_status(db):
+    """ Return a status -> order count map """
+    return {rollup['Key']: rollup['Orders'] for rollup in db[ROLLUPS].find({"Dimension": STATUS}, {"_id": 0})}
+
+if __name__ == "__main__":
+    from database import get_database
+    rebuilt = rebuild_sales(get_database())
+    print(f"Rebuilt {rebuilt} sales rollups")
@@ -0,0 +1,99 @@
+""" Compare synchronous and queued order placement under concurrent, retried submissions
+
+Usage: python benchmarks/bench_orders.py [--mock] [--sessions N] [--orders N] [--retries N]
+                                         [--stock N] [--database NAME]
+
+Every simulated session places its orders and resubmits each one --retries extra times with
+the same idempotency key, as a double click or a rerun would. The report shows throughput for
+both paths and checks that no key produced more than one order. Book 1 is a hot title stocked
+with only --stock units, and the report checks it was not oversold. Without --mock the scratch
+database (BookstoreBench by default) on the configured MongoDB is dropped and reseeded.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import services
+from database import get_client
+from order_queue import OrderQueue
+from synthetic import seed_database
+
+def open_database(args):
+    """ Return the scratch database to benchmark against """
+    if args.mock:
+        import mongomock
+        return mongomock.MongoClient()[args.database]
+    return get_client()[args.database]
+
+def run_sessions(args, place):
+    """ Run concurrent sessions calling place(user_id, book_id, key) and return the elapsed seconds """
+    def session(user_id):
+        for order in range(args.orders):
+            key = uuid.uuid4().hex
+            for _ in range(args.retries + 1):
+                place(user_id, order % 50 + 1, key)
+
+    threads = [threading.Thread(target=session, args=(user_id,)) for user_id in range(1, args.sessions + 1)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+def duplicate_keys(db):
+    """ Count idempotency keys that ended up on more than one order """
+    pipeline = [
+        {"$match": {"IdempotencyKey": {"$exists": True}}},
+        {"$group": {"_id": "$IdempotencyKey", "orders": {"$sum": 1}}},
+        {"$match": {"orders": {"$gt": 1}}},
+    ]
+    return len(list(db["Orders"].aggregate(pipeline)))
+
+def reset_orders(db, args):
+    """ Clear orders and give the hot title its limited stock """
+    db["Orders"].delete_many({})
+    db["Books"].update_one({"BookID": 1}, {"$set": {"stock": args.stock}})
+
+def report(name, db, args, seconds):
+    """ Print throughput, duplicate and oversell checks for one run """
+    submitted = args.sessions * args.orders
+    stored = db["Orders"].count_documents({"IdempotencyKey": {"$exists": True}})
+    sold = db["Orders"].count_documents({"BookID": 1, "OrderStatus": "Processing"})
+    left = db["Books"].find_one({"BookID": 1})['stock']
+    print(f"{name:<12}{submitted / seconds:>10,.0f} orders/s   {stored} stored for {submitted} unique clicks   "
+          f"{duplicate_keys(db)} duplicate keys   hot title: {sold} sold + {left} left of {args.stock}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mock", action="store_true", help="use an in-memory mongomock database")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--orders", type=int, default=50)
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--stock", type=int, default=10, help="units of the hot title in stock")
+    parser.add_argument("--database", default="BookstoreBench")
+    args = parser.parse_args()
+
+    db = open_database(args)
+    seed_database(db, books=50, users=args.sessions, orders=0, reviews=0)
+    services.setup_database(db)
+    reset_orders(db, args)
+    seconds = run_sessions(args, lambda user_id, book_id, key: services.order_book(db, user_id, book_id, 9.99, key))
+    report("synchronous", db, args, seconds)
+
+    reset_orders(db, args)
+    order_queue = OrderQueue(db)
+    seconds = run_sessions(args, lambda user_id, book_id, key: order_queue.submit(user_id, book_id, 9.99, key))
+    # Count the time until every queued order is stored, not just until it is accepted
+    started = time.perf_counter()
+    order_queue.flush()
+    report("queued", db, args, seconds + time.perf_counter() - started)
+
+if __name__ == "__main__":
+    main()
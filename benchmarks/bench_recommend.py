@@ -0,0 +1,61 @@
+""" Report the time and peak memory of the recommendation build on synthetic interactions
+
+Usage: python benchmarks/bench_recommend.py [--orders N] [--reviews N] [--books N] [--users N]
+                                            [--top-k N] [--block-size N]
+
+Interactions are generated straight into arrays with a long-tailed book popularity, so the
+numbers cover the similarity computation without a database. Peak memory is measured with
+tracemalloc, which sees numpy and scipy allocations.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from recommend import BLOCK_SIZE, PURCHASE_WEIGHT, RATING_WEIGHT, TOP_K, interaction_matrix, similar_books
+
+def synthetic_interactions(count, books, users, rng):
+    """ Return UserID and BookID arrays where a few books are far more popular than the rest """
+    popularity = 1.0 / np.arange(1, books + 1) ** 0.8
+    return (rng.integers(1, users + 1, count),
+            rng.choice(np.arange(1, books + 1), size=count, p=popularity / popularity.sum()))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=2_000_000)
+    parser.add_argument("--reviews", type=int, default=500_000)
+    parser.add_argument("--books", type=int, default=50_000)
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(552)
+    purchase_users, purchase_books = synthetic_interactions(args.orders, args.books, args.users, rng)
+    rating_users, rating_books = synthetic_interactions(args.reviews, args.books, args.users, rng)
+    ratings = rng.integers(1, 6, args.reviews).astype(np.float64)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    book_ids = np.unique(np.concatenate([purchase_books, rating_books]))
+    matrices = [
+        (interaction_matrix(purchase_users, purchase_books, book_ids), PURCHASE_WEIGHT),
+        (interaction_matrix(rating_users, rating_books, book_ids, ratings, centre=True), RATING_WEIGHT),
+    ]
+    built = time.perf_counter() - started
+    neighbours = sum(len(found) for _, found, _ in similar_books(matrices, args.top_k, args.block_size))
+    total = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print(f"{args.orders:,} orders and {args.reviews:,} reviews over {len(book_ids):,} books")
+    print(f"matrices built in {built:.1f}s, {neighbours:,} neighbours found in {total - built:.1f}s")
+    print(f"peak memory {peak / 2**20:,.0f} MiB with blocks of {args.block_size} books")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+""" Report MongoDB round trips and timings for each Streamlit rerun of final.py for a logged-in customer
+
+Usage: python benchmarks/bench_rerun_queries.py [--mock] [--reruns N] [--user-id ID]
+
+With --mock the app runs against an in-memory mongomock database seeded from the JSON dumps
+(requires the mongomock package); otherwise it uses the MongoDB configured in database.py.
+"""
+import argparse
+import collections
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database
+from bulk_io import import_documents, iter_documents
+
+DUMPS = {"Books": "1 books.json", "Orders": "2 orders.json", "Reviews": "3 reviews.json", "Users": "4 users.json"}
+
+def use_mock_database():
+    """ Point database.py at a seeded in-memory mongomock client """
+    import mongomock
+
+    client = mongomock.MongoClient()
+    db = client[database.load_settings()['database']]
+    for name, filename in DUMPS.items():
+        with open(os.path.join(ROOT, filename), encoding="utf-8") as stream:
+            import_documents(db, name, iter_documents(stream, "json"))
+    database.create_client = lambda settings: client
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mock", action="store_true", help="run against a seeded mongomock database")
+    parser.add_argument("--reruns", type=int, default=5)
+    parser.add_argument("--user-id", default="487")
+    args = parser.parse_args()
+
+    from streamlit.testing.v1 import AppTest
+
+    if args.mock:
+        use_mock_database()
+
+    app = AppTest.from_file(os.path.join(ROOT, "final.py"), default_timeout=60)
+    app.run()
+    next(button for button in app.button if button.label == "Customer").click().run()
+    app.text_input[0].input(args.user_id)
+    next(button for button in app.button if button.label == "Login").click().run()
+    app.run()
+    if app.exception:
+        raise SystemExit(f"App raised: {app.exception[0].message}")
+
+    print(f"{'rerun':<8}{'round trips':>12}{'db ms':>10}{'render ms':>11}  breakdown")
+    for rerun in range(1, args.reruns + 1):
+        app.run()
+        # final.py keeps the statistics collected by instrumentation.py for the last rerun
+        stats = app.session_state['last_rerun_stats']
+        counts = collections.Counter(f"{query['collection']}.{query['method']}" for query in stats['queries'])
+        breakdown = ", ".join(f"{name} x{count}" for name, count in sorted(counts.items()))
+        print(f"{rerun:<8}{stats['query_count']:>12}{stats['db_ms']:>10.1f}{stats['render_ms']:>11.1f}  {breakdown}")
+
+if __name__ == "__main__":
+    main()
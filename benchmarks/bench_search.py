@@ -0,0 +1,39 @@
+""" Report search latency percentiles against a synthetic catalog
+
+Usage: python benchmarks/bench_search.py [number_of_books]
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import SEARCH_FIELDS, build_search_index, search_index
+from synthetic import GENRES, WORDS, synthetic_books
+from timing import percentile
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rng = random.Random(552)
+    books = synthetic_books(count, rng)
+
+    started = time.perf_counter()
+    index = build_search_index(books)
+    print(f"Indexed {count} books in {time.perf_counter() - started:.2f}s")
+
+    for field in SEARCH_FIELDS:
+        terms = [rng.choice(WORDS)[:rng.randrange(2, 6)] for _ in range(200)]
+        if field == "genre":
+            terms = [rng.choice(GENRES).lower()[:rng.randrange(3, 8)] for _ in range(200)]
+        latencies = []
+        for term in terms:
+            started = time.perf_counter()
+            search_index(index, term, field, limit=48)
+            latencies.append((time.perf_counter() - started) * 1000)
+        print(f"{field:<10} p50 {statistics.median(latencies):7.2f} ms   "
+              f"p99 {percentile(latencies, 0.99):7.2f} ms")
+
+if __name__ == "__main__":
+    main()
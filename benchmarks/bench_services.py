@@ -0,0 +1,92 @@
+""" Report throughput and latency percentiles of the service layer on a synthetic catalog
+
+Usage: python benchmarks/bench_services.py [--mock] [--books N] [--users N] [--orders N]
+                                           [--reviews N] [--iterations N] [--database NAME]
+
+With --mock the data lives in an in-memory mongomock database (requires the mongomock
+package). Otherwise it is written to a scratch database on the MongoDB configured in
+database.py; that database is dropped and reseeded, so never point it at real data.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import analytics
+import services
+from database import get_client
+from search import build_search_index
+from synthetic import GENRES, STATUSES, WORDS, seed_database
+from timing import format_latencies, time_calls
+
+def open_database(args):
+    """ Return the scratch database to benchmark against """
+    if args.mock:
+        import mongomock
+        return mongomock.MongoClient()[args.database]
+    return get_client()[args.database]
+
+def build_operations(db, args, rng):
+    """ Return (name, operation) pairs, each operation taking the iteration number """
+    index = build_search_index(list(db["Books"].find({}, services.BOOK_CARD_FIELDS)))
+    ratings = {summary['BookID']: summary for summary in db["Ratings"].find({}, {"_id": 0})}
+    review_pages = max(1, db["Ratings"].count_documents({}) // services.REVIEW_BOOKS_PER_PAGE)
+    search_fields = ["title", "author", "publisher", "genre"]
+
+    def search(iteration):
+        field = search_fields[iteration % len(search_fields)]
+        term = rng.choice(GENRES) if field == "genre" else rng.choice(WORDS)[:rng.randrange(2, 6)]
+        services.search_books(index, term, field, "rating" if iteration % 2 else "relevance", ratings)
+
+    return [
+        ("authenticate_user", lambda i: services.authenticate_user(db, rng.randrange(1, args.users + 1), "Customer")),
+        ("fetch_books_page", lambda i: services.fetch_books_page(db, rng.randrange(args.books))),
+        ("search_books", search),
+        ("fetch_review_groups", lambda i: services.fetch_review_groups(db, rng.randrange(review_pages))),
+        ("fetch_orders_page", lambda i: services.fetch_orders_page(
+            db, services.build_order_query(statuses=[rng.choice(STATUSES)]),
+            [("OrderDate", -1), ("OrderID", -1)], rng.randrange(5))),
+        ("fetch_user_orders", lambda i: services.fetch_user_orders(db, rng.randrange(1, args.users + 1))),
+        ("order_book", lambda i: services.order_book(
+            db, rng.randrange(1, args.users + 1), rng.randrange(1, args.books + 1), 9.99)),
+        ("add_review", lambda i: services.add_review(
+            db, rng.randrange(1, args.users + 1), rng.randrange(1, args.books + 1), rng.randint(1, 5), "Benchmark")),
+        ("add_book", lambda i: services.add_book(
+            db, f"Benchmark Title {time.time_ns()}", "Author", 12.5, "Fiction", 2000, "Press")),
+        ("update_order_status", lambda i: services.update_order_status(
+            db, {"OrderID": rng.randrange(1, args.orders + 1)}, rng.choice(STATUSES))),
+        ("sales_dashboard", lambda i: (analytics.orders_by_status(db), analytics.revenue_by_day(db),
+                                       analytics.top_sales(db, analytics.BOOK), analytics.top_sales(db, analytics.GENRE),
+                                       analytics.top_sales(db, analytics.PUBLISHER))),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mock", action="store_true", help="use an in-memory mongomock database")
+    parser.add_argument("--books", type=int, default=10_000)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--orders", type=int, default=50_000)
+    parser.add_argument("--reviews", type=int, default=20_000)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--database", default="BookstoreBench")
+    args = parser.parse_args()
+
+    db = open_database(args)
+    started = time.perf_counter()
+    seed_database(db, args.books, args.users, args.orders, args.reviews)
+    print(f"Seeded {args.books} books, {args.users} users, {args.orders} orders and "
+          f"{args.reviews} reviews in {time.perf_counter() - started:.1f}s")
+    started = time.perf_counter()
+    services.setup_database(db)
+    print(f"Built indexes, rating summaries and sales rollups in {time.perf_counter() - started:.1f}s")
+
+    rng = random.Random(552)
+    for name, operation in build_operations(db, args, rng):
+        print(format_latencies(name, time_calls(operation, args.iterations)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+""" Synthetic Books, Users, Orders and Reviews shaped like the JSON dumps, for benchmarks """
+import random
+from datetime import date, timedelta
+
+WORDS = ["river", "shadow", "garden", "empire", "winter", "silent", "golden", "night",
+         "ocean", "stone", "crimson", "forest", "memory", "storm", "glass", "journey"]
+GENRES = ["Fiction", "Science Fiction", "Fantasy", "Mystery", "Romance", "Dystopian",
+          "Historical Fiction", "Thriller", "Biography", "Poetry"]
+STATUSES = ["Processing", "Shipped", "Delivered"]
+COMMENTS = ["Great book!", "Not quite what I expected.", "Well-written and engaging.",
+            "Interesting read, but a bit slow in the middle.", "Loved every chapter!"]
+
+FIRST_DATE = date(2020, 1, 1)
+
+def synthetic_books(count, rng):
+    """ Generate books with BookIDs 1..count """
+    return [{
+        "BookID": book_id,
+        "title": f"{' '.join(rng.sample(WORDS, 3)).title()} {book_id}",
+        "author": f"{rng.choice(WORDS).title()} Author{rng.randrange(5000)}",
+        "price": round(rng.uniform(5, 40), 2),
+        "genre": rng.choice(GENRES),
+        "published_year": rng.randrange(1800, 2024),
+        "publisher": f"{rng.choice(WORDS).title()} Press {rng.randrange(500)}",
+    } for book_id in range(1, count + 1)]
+
+def synthetic_users(count):
+    """ Generate customers with UserIDs 1..count and one admin after them """
+    users = [{"UserID": user_id, "Username": f"user{user_id}", "Email": f"user{user_id}@example.com",
+              "UserType": "Customer"} for user_id in range(1, count + 1)]
+    users.append({"UserID": count + 1, "Username": "admin", "Email": "admin@example.com", "UserType": "Admin"})
+    return users
+
+def _random_date(rng):
+    return (FIRST_DATE + timedelta(days=rng.randrange(5 * 365))).strftime('%Y-%m-%d')
+
+def iter_synthetic_orders(count, books, users, rng):
+    """ Yield orders for random customers and books """
+    for order_id in range(1, count + 1):
+        book_id = rng.randrange(1, books + 1)
+        yield {
+            "OrderID": order_id,
+            "UserID": rng.randrange(1, users + 1),
+            "OrderDate": _random_date(rng),
+            "BookID": book_id,
+            "Price": round(rng.uniform(5, 40), 2),
+            "OrderStatus": rng.choice(STATUSES),
+        }
+
+def iter_synthetic_reviews(count, books, users, rng):
+    """ Yield reviews for random customers and books """
+    for review_id in range(1, count + 1):
+        yield {
+            "ReviewID": review_id,
+            "BookID": rng.randrange(1, books + 1),
+            "UserID": rng.randrange(1, users + 1),
+            "Rating": rng.randint(1, 5),
+            "Comment": rng.choice(COMMENTS),
+            "ReviewDate": _random_date(rng),
+        }
+
+def seed_database(db, books, users, orders, reviews, seed=552, batch_size=10_000):
+    """ Replace the four collections with synthetic data of the given sizes """
+    rng = random.Random(seed)
+    sources = {
+        "Books": iter(synthetic_books(books, rng)),
+        "Users": iter(synthetic_users(users)),
+        "Orders": iter_synthetic_orders(orders, books, users, rng),
+        "Reviews": iter_synthetic_reviews(reviews, books, users, rng),
+    }
+    # Derived collections go too, so setup_database() rebuilds them from the new data
+    for name in ("Books", "Users", "Orders", "Reviews", "Ratings", "SalesRollups", "Recommendations", "Counters"):
+        db[name].drop()
+    for name, documents in sources.items():
+        batch = []
+        for document in documents:
+            batch.append(document)
+            if len(batch) == batch_size:
+                db[name].insert_many(batch)
+                batch = []
+        if batch:
+            db[name].insert_many(batch)
@@ -0,0 +1,24 @@
+""" Latency bookkeeping shared by the benchmark scripts """
+import statistics
+import time
+
+def percentile(samples, fraction):
+    """ Return the sample at the given fraction of the sorted samples """
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def time_calls(operation, iterations):
+    """ Call operation(iteration) repeatedly and return per-call latencies in milliseconds """
+    latencies = []
+    for iteration in range(iterations):
+        started = time.perf_counter()
+        operation(iteration)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+def format_latencies(name, latencies):
+    """ Format throughput and p50/p95/p99 latency for one operation """
+    total_seconds = sum(latencies) / 1000
+    throughput = len(latencies) / total_seconds if total_seconds else float("inf")
+    return (f"{name:<24}{throughput:>10,.0f} ops/s   p50 {statistics.median(latencies):8.2f} ms   "
+            f"p95 {percentile(latencies, 0.95):8.2f} ms   p99 {percentile(latencies, 0.99):8.2f} ms")
@@ -0,0 +1,282 @@
+""" Streaming bulk import and export for the Books, Orders, Reviews and Users collections
+
+Usage:
+    python bulk_io.py import Books "1 books.json"
+    python bulk_io.py export Orders orders.ndjson
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+import time
+
+from bson import json_util
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+
+from analytics import rebuild_sales
+from database import create_client, load_settings
+from ratings import rebuild_ratings
+from services import ACTIVE_BOOKS
+
+# Business key used to upsert documents of each collection
+KEY_FIELDS = {"Books": "BookID", "Orders": "OrderID", "Reviews": "ReviewID", "Users": "UserID"}
+
+# Collections whose IDs are handed out by the Counters collection
+COUNTED_COLLECTIONS = ("Books", "Orders", "Reviews")
+
+# Live inventory survives a re-import; a file's stock only seeds books that are new
+INVENTORY_FIELDS = ("stock",)
+
+# Set on new books unless the file says otherwise, so re-importing keeps soft-deleted books deleted
+BOOK_DEFAULTS = {"active": True}
+
+# Schema fields that CSV stores as text; every other column is kept as a string, so a title
+# such as "1984" or "NaN" is not mistaken for a number
+INT_FIELDS = {"BookID", "OrderID", "ReviewID", "UserID", "published_year", "Rating", "stock", "version"}
+FLOAT_FIELDS = {"price", "Price"}
+BOOL_FIELDS = {"active"}
+
+BATCH_SIZE = 1000
+_READ_CHUNK_SIZE = 64 * 1024
+_SEPARATORS = " \t\r\n,"
+
+def detect_format(path):
+    """ Guess the file format from its extension """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".ndjson", ".jsonl"):
+        return "ndjson"
+    if extension == ".csv":
+        return "csv"
+    return "json"
+
+def iter_json_array(stream):
+    """ Yield documents from a JSON array one at a time without loading the whole file """
+    # json_util's hook turns extended JSON ($oid, $date, ...) into Python values
+    decoder = json.JSONDecoder(object_hook=json_util.object_hook)
+    buffer, position, opened = "", 0, False
+    while True:
+        while position < len(buffer) and buffer[position] in _SEPARATORS:
+            position += 1
+        if position < len(buffer):
+            if not opened:
+                if buffer[position] != "[":
+                    raise ValueError("Expected a JSON array")
+                opened = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                return
+            try:
+                document, position = decoder.raw_decode(buffer, position)
+                yield document
+                continue
+            except json.JSONDecodeError:
+                pass  # The element is split across chunks; read more input
+        chunk = stream.read(_READ_CHUNK_SIZE)
+        if not chunk:
+            raise ValueError("Unexpected end of JSON array")
+        buffer = buffer[position:] + chunk
+        position = 0
+
+def iter_ndjson(stream):
+    """ Yield documents from newline-delimited JSON """
+    for line in stream:
+        if line.strip():
+            yield json.loads(line, object_hook=json_util.object_hook)
+
+def _coerce(field, value):
+    """ Turn a CSV cell of a numeric or boolean schema field back into its type; other cells stay text """
+    try:
+        if field in INT_FIELDS:
+            return int(value)
+        if field in FLOAT_FIELDS:
+            number = float(value)
+            if not math.isfinite(number):
+                raise ValueError
+            return number
+    except ValueError:
+        raise ValueError(f"Invalid {field} in CSV: {value!r}")
+    if field in BOOL_FIELDS:
+        return value.strip().lower() == "true"
+    return value
+
+def iter_csv(stream):
+    """ Yield documents from a CSV file with a header row """
+    for row in csv.DictReader(stream):
+        yield {field: _coerce(field, value) for field, value in row.items() if value != ""}
+
+READERS = {"json": iter_json_array, "ndjson": iter_ndjson, "csv": iter_csv}
+
+def iter_documents(stream, file_format):
+    """ Yield documents from a stream in the given format """
+    return READERS[file_format](stream)
+
+def _batches(documents, size):
+    """ Group an iterable into lists of at most size items """
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _drop_duplicate_titles(collection, batch, key_field):
+    """ Remove books whose title already belongs to another active BookID, returning the kept books and skipped titles """
+    kept, skipped, seen = [], [], {}
+    for document in batch:
+        title = document.get('title')
+        if title in seen and seen[title] != document.get(key_field):
+            skipped.append(title)
+        else:
+            seen[title] = document.get(key_field)
+            kept.append(document)
+    # One indexed lookup per batch finds titles already owned by a different book; as in
+    # add_book, deleted books do not hold on to their titles
+    existing = {
+        book['title']: book[key_field]
+        for book in collection.find({"title": {"$in": list(seen)}, **ACTIVE_BOOKS}, {"title": 1, key_field: 1})
+    }
+    result = []
+    for document in kept:
+        owner = existing.get(document.get('title'))
+        if owner is not None and owner != document.get(key_field):
+            skipped.append(document['title'])
+        else:
+            result.append(document)
+    return result, skipped
+
+def _book_upsert(document):
+    """ Upsert a book by BookID, setting only the imported fields and keeping its live stock """
+    on_insert = {field: value for field, value in BOOK_DEFAULTS.items() if field not in document}
+    on_insert.update((field, document.pop(field)) for field in INVENTORY_FIELDS if field in document)
+    update = {"$set": document}
+    if on_insert:
+        update["$setOnInsert"] = on_insert
+    return UpdateOne({"BookID": document['BookID']}, update, upsert=True)
+
+def _upsert(name, key_field, document):
+    """ Build the write that upserts one imported document """
+    if name == "Books":
+        return _book_upsert(document)
+    return ReplaceOne({key_field: document[key_field]}, document, upsert=True)
+
+def _sync_counters(db, name, key_field):
+    """ Make sure the ID counter is not behind the imported IDs """
+    highest = db[name].find_one({}, {key_field: 1}, sort=[(key_field, -1)])
+    if highest:
+        db["Counters"].update_one({"_id": name}, {"$max": {"seq": highest[key_field]}}, upsert=True)
+
+def import_documents(db, name, documents, batch_size=BATCH_SIZE, report=None):
+    """ Upsert documents into a collection in ordered batches and return import statistics """
+    key_field = KEY_FIELDS[name]
+    collection = db[name]
+    collection.create_index([(key_field, ASCENDING)], unique=True)
+    if name == "Books":
+        collection.create_index([("title", ASCENDING)])
+
+    stats = {"read": 0, "upserted": 0, "modified": 0, "skipped_titles": [], "seconds": 0.0}
+    started = time.perf_counter()
+    # Imported books may change, so they get a new version and their cached cards are redrawn
+    version = time.time_ns()
+    for batch in _batches(documents, batch_size):
+        stats['read'] += len(batch)
+        for document in batch:
+            # Documents are matched on their business key, not on the dump's ObjectId
+            document.pop('_id', None)
+            if name == "Books":
+                document["version"] = version
+        if name == "Books":
+            batch, skipped = _drop_duplicate_titles(collection, batch, key_field)
+            stats['skipped_titles'].extend(skipped)
+        if batch:
+            result = collection.bulk_write(
+                [_upsert(name, key_field, document) for document in batch],
+                ordered=True
+            )
+            stats['upserted'] += result.upserted_count
+            stats['modified'] += result.modified_count
+        stats['seconds'] = time.perf_counter() - started
+        if report:
+            report(stats)
+
+    if name in COUNTED_COLLECTIONS:
+        _sync_counters(db, name, key_field)
+    if name == "Reviews":
+        rebuild_ratings(db)
+    if name == "Orders":
+        rebuild_sales(db)
+    return stats
+
+def _csv_fields(collection, key_field, batch_size):
+    """ Collect every field used in a collection, key first, in the order they first appear """
+    fields = {key_field: None}
+    for document in collection.find({}, {"_id": 0}).batch_size(batch_size):
+        fields.update(dict.fromkeys(document))
+    return list(fields)
+
+def export_documents(db, name, stream, file_format, batch_size=BATCH_SIZE):
+    """ Stream a collection to a file in the given format and return the number of documents written """
+    key_field = KEY_FIELDS[name]
+    cursor = db[name].find({}, {"_id": 0}).sort(key_field, ASCENDING).batch_size(batch_size)
+    written = 0
+    writer = None
+    if file_format == "json":
+        stream.write("[")
+    elif file_format == "csv":
+        # A CSV header is written before any row, so a first pass finds the fields of every
+        # document; a field added between the passes makes the writer raise rather than drop it
+        writer = csv.DictWriter(stream, fieldnames=_csv_fields(db[name], key_field, batch_size))
+        writer.writeheader()
+    for document in cursor:
+        if file_format == "json":
+            stream.write(",\n" if written else "\n")
+            stream.write(json_util.dumps(document))
+        elif file_format == "ndjson":
+            stream.write(json_util.dumps(document) + "\n")
+        else:
+            writer.writerow(document)
+        written += 1
+    if file_format == "json":
+        stream.write("\n]\n")
+    return written
+
+def _print_progress(stats):
+    """ Print running import throughput """
+    rate = stats['read'] / stats['seconds'] if stats['seconds'] else 0
+    print(f"  {stats['read']} read, {stats['upserted']} inserted, {stats['modified']} updated "
+          f"({rate:,.0f} docs/s)", file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("collection", choices=sorted(KEY_FIELDS))
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=sorted(READERS), help="defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--uri", help="overrides the configured MongoDB URI")
+    parser.add_argument("--database", help="overrides the configured database name")
+    args = parser.parse_args(argv)
+
+    settings = load_settings()
+    settings.update({name: value for name, value in (("uri", args.uri), ("database", args.database)) if value})
+    db = create_client(settings)[settings['database']]
+    file_format = args.format or detect_format(args.path)
+    if args.action == "import":
+        with open(args.path, encoding="utf-8", newline="") as stream:
+            stats = import_documents(db, args.collection, iter_documents(stream, file_format),
+                                     args.batch_size, report=_print_progress)
+        print(f"Imported {stats['read']} documents into {args.collection} in {stats['seconds']:.2f}s")
+        if stats['skipped_titles']:
+            print(f"Skipped {len(stats['skipped_titles'])} books with duplicate titles")
+    else:
+        started = time.perf_counter()
+        with open(args.path, "w", encoding="utf-8", newline="") as stream:
+            written = export_documents(db, args.collection, stream, file_format, args.batch_size)
+        print(f"Exported {written} documents from {args.collection} in {time.perf_counter() - started:.2f}s")
+
+if __name__ == "__main__":
+    main()
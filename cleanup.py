@@ -0,0 +1,87 @@
+""" Background cleanup of reviews, ratings and recommendations left behind by deleted books
+
+Usage: python cleanup.py
+
+Deleting books only flags them inactive, which is a single update. This job then removes
+whatever still points at those books, a batch of BookIDs at a time. Orders are kept, since they
+are history and their books stay in Books as inactive documents. The admin interface hands the
+deleted BookIDs to a background thread; run as a script, the job sweeps every inactive book,
+read from the (active, BookID) index.
+"""
+import threading
+
+BATCH_SIZE = 1_000
+
+# Collections whose documents are meaningless once their book is gone
+DEPENDENT_COLLECTIONS = ("Reviews", "Ratings", "Recommendations")
+
+# Whether a cleanup thread is running, and the deleted BookIDs it has yet to clean up
+_lock = threading.Lock()
+_state = {"running": False, "pending": set()}
+
+def inactive_book_batches(db, batch_size=BATCH_SIZE):
+    """ Yield the BookIDs of soft-deleted books in sorted batches """
+    batch = []
+    for book in db["Books"].find({"active": False}, {"_id": 0, "BookID": 1}).sort("BookID", 1).batch_size(batch_size):
+        batch.append(book['BookID'])
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def delete_dependents(db, book_ids):
+    """ Delete the documents of the given books that are still inactive and return a collection -> deleted map """
+    book_ids = db["Books"].distinct("BookID", {"BookID": {"$in": list(book_ids)}, "active": False})
+    return {name: db[name].delete_many({"BookID": {"$in": book_ids}}).deleted_count if book_ids else 0
+            for name in DEPENDENT_COLLECTIONS}
+
+def cleanup_orphans(db, batch_size=BATCH_SIZE):
+    """ Delete documents that reference any deleted book and return a collection -> deleted map """
+    deleted = {name: 0 for name in DEPENDENT_COLLECTIONS}
+    for batch in inactive_book_batches(db, batch_size):
+        for name, count in delete_dependents(db, batch).items():
+            deleted[name] += count
+    return deleted
+
+def _next_batch(batch_size):
+    """ Claim up to batch_size pending BookIDs, or mark the thread finished when there are none """
+    with _lock:
+        if not _state['pending']:
+            _state['running'] = False
+            return None
+        batch = sorted(_state['pending'])[:batch_size]
+        _state['pending'].difference_update(batch)
+        return batch
+
+def start_cleanup(db, book_ids, batch_size=BATCH_SIZE):
+    """ Clean up after the given deleted books on a daemon thread, or hand them to the running one
+
+    Returns True when a new thread was started. BookIDs queued while a batch is running are
+    never lost: the thread keeps going until none are pending.
+    """
+    with _lock:
+        _state['pending'].update(book_ids)
+        if _state['running']:
+            return False
+        _state['running'] = True
+
+    def run():
+        try:
+            batch = _next_batch(batch_size)
+            while batch is not None:
+                delete_dependents(db, batch)
+                batch = _next_batch(batch_size)
+        except BaseException:
+            # _next_batch clears the flag on a normal exit; the unfinished IDs wait for the next delete
+            with _lock:
+                _state['running'] = False
+            raise
+
+    threading.Thread(target=run, name="orphan-cleanup", daemon=True).start()
+    return True
+
+if __name__ == "__main__":
+    from database import get_database
+    for name, count in cleanup_orphans(get_database()).items():
+        print(f"Deleted {count} {name} documents of deleted books")
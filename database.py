@@ -0,0 +1,75 @@
+""" MongoDB connection settings and the lazily created client shared by the whole process
+
+Settings come from, in increasing priority: the defaults below, a JSON config file
+(bookstore.json, or the path in BOOKSTORE_CONFIG) and BOOKSTORE_MONGO_* environment variables,
+e.g. BOOKSTORE_MONGO_URI or BOOKSTORE_MONGO_MAX_POOL_SIZE.
+"""
+import json
+import os
+import threading
+
+from pymongo import MongoClient
+
+DEFAULT_SETTINGS = {
+    "uri": "mongodb://localhost:27017/",
+    "database": "BookstoreDB",
+    "max_pool_size": 50,
+    "min_pool_size": 0,
+    "connect_timeout_ms": 5000,
+    "server_selection_timeout_ms": 5000,
+    "socket_timeout_ms": 20000,
+    "read_preference": "primary",
+    "write_concern": "1",
+}
+
+CONFIG_PATH_ENV = "BOOKSTORE_CONFIG"
+DEFAULT_CONFIG_PATH = "bookstore.json"
+ENV_PREFIX = "BOOKSTORE_MONGO_"
+
+_client = None
+_client_lock = threading.Lock()
+
+def load_settings():
+    """ Merge the defaults with the config file and environment overrides """
+    settings = dict(DEFAULT_SETTINGS)
+    path = os.environ.get(CONFIG_PATH_ENV, DEFAULT_CONFIG_PATH)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as config_file:
+            settings.update(json.load(config_file).get("mongo", {}))
+    for name, default in DEFAULT_SETTINGS.items():
+        value = os.environ.get(ENV_PREFIX + name.upper())
+        if value is not None:
+            settings[name] = type(default)(value)
+    return settings
+
+def _write_concern(value):
+    """ Numeric write concerns are passed as ints, tag sets such as "majority" as strings """
+    value = str(value)
+    return int(value) if value.isdigit() else value
+
+def create_client(settings):
+    """ Create a MongoClient configured from the given settings """
+    # MongoClient connects in the background, so creating it does not block on the server
+    return MongoClient(
+        settings['uri'],
+        maxPoolSize=int(settings['max_pool_size']),
+        minPoolSize=int(settings['min_pool_size']),
+        connectTimeoutMS=int(settings['connect_timeout_ms']),
+        serverSelectionTimeoutMS=int(settings['server_selection_timeout_ms']),
+        socketTimeoutMS=int(settings['socket_timeout_ms']),
+        readPreference=settings['read_preference'],
+        w=_write_concern(settings['write_concern']),
+    )
+
+def get_client():
+    """ Return the process-wide client, creating it on first use """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = create_client(load_settings())
+    return _client
+
+def get_database():
+    """ Return the configured database on the shared client """
+    return get_client()[load_settings()['database']]
@@ -1,30 +1,106 @@
+import functools
+import io
 import streamlit as st
-from datetime import date
-from pymongo import MongoClient
-
-# MongoDB connection URI
-MONGO_URI = "mongodb://localhost:27017/"
-
-# Create a MongoDB client
-client = MongoClient(MONGO_URI)
-
-# Access the database
-db = client["BookstoreDB"]
-
-# Access collections
-books_collection = db["Books"]
-orders_collection = db["Orders"]
-reviews_collection = db["Reviews"]
-users_collection = db["Users"]
-
-# Fetch data
-books_data = list(books_collection.find())
-users_data = list(users_collection.find())
-orders_data = list(orders_collection.find())
-reviews_data = list(reviews_collection.find())
+import threading
+import time
+import uuid
+from pymongo import ASCENDING, DESCENDING
+import services
+from analytics import BOOK, GENRE, PUBLISHER, orders_by_status, rebuild_sales, revenue_by_day, top_sales
+from cleanup import start_cleanup
+from database import get_database
+from inventory import BACKORDERED, restock
+from instrumentation import finish_rerun, instrument_database, repeated_queries, start_callback, start_rerun
+from order_queue import FAILED, PLACED, OrderQueue
+from ratings import rating_summaries, rebuild_ratings
+from render import CSS, book_card_html, card_cache_stats, order_card_html, order_cards_html, review_cards_html
+from search import build_search_index
+from services import SEARCH_RESULT_LIMIT
+
+# Count and time every query made during this rerun; see instrumentation.py
+start_rerun()
+
+def counted(callback):
+    """ Count a widget callback's queries with the rerun it triggers; use on callbacks only """
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        start_callback()
+        return callback(*args, **kwargs)
+    return wrapper
+
+# The client is created lazily and shared by every session; see database.py for settings
+db = instrument_database(get_database())
+
+# Access collections; queries themselves live in services.py
+ratings_collection = db["Ratings"]
+
+@st.cache_resource
+def setup_database():
+    """ Create indexes, seed ID counters and rating summaries once per process; returns the renumbered IDs """
+    return services.setup_database(db)
+
+# Seconds a cached collection snapshot stays fresh before it is refetched
+CATALOG_TTL_SECONDS = 300
+
+# Filters applied to cached snapshots; soft-deleted books are never shown
+CATALOG_FILTERS = {"Books": services.ACTIVE_BOOKS}
+
+@st.cache_resource
+def get_catalog_cache():
+    """ Process-wide cache of collection snapshots shared by every session """
+    return {"entries": {}, "generations": {}, "hits": 0, "misses": 0, "lock": threading.Lock()}
+
+def load_collection(name):
+    """ Return all documents of a collection, served from the catalog cache while fresh """
+    cache = get_catalog_cache()
+    with cache['lock']:
+        entry = cache['entries'].get(name)
+        if entry and time.monotonic() - entry['loaded_at'] < CATALOG_TTL_SECONDS:
+            cache['hits'] += 1
+            return entry['documents']
+        cache['misses'] += 1
+        generation = cache['generations'].get(name, 0)
+    documents = list(db[name].find(CATALOG_FILTERS.get(name, {})))
+    with cache['lock']:
+        # A write invalidated the collection during the fetch, so this snapshot may predate it
+        if cache['generations'].get(name, 0) == generation:
+            cache['entries'][name] = {"documents": documents, "loaded_at": time.monotonic()}
+    return documents
+
+def invalidate_collection(*names):
+    """ Drop cached snapshots so the next read refetches them from MongoDB """
+    cache = get_catalog_cache()
+    with cache['lock']:
+        for name in names:
+            cache['entries'].pop(name, None)
+            cache['generations'][name] = cache['generations'].get(name, 0) + 1
+
+def catalog_cache_stats():
+    """ Return hit/miss counters and the collections currently cached """
+    cache = get_catalog_cache()
+    with cache['lock']:
+        return {
+            "hits": cache['hits'],
+            "misses": cache['misses'],
+            "cached": sorted(cache['entries']),
+        }
+
+# Order statuses and sort orders of the admin order view
+ORDER_STATUSES = ["Processing", "Backordered", "Shipped", "Delivered"]
+# Backordered is set only by order placement, when a title is sold out
+SETTABLE_STATUSES = [status for status in ORDER_STATUSES if status != BACKORDERED]
+
+# Days of revenue and number of top books, genres and publishers shown on the analytics view
+ANALYTICS_DAYS = 30
+ANALYTICS_TOP = 10
+ORDER_SORTS = {
+    "Newest first": [("OrderDate", DESCENDING), ("OrderID", DESCENDING)],
+    "Oldest first": [("OrderDate", ASCENDING), ("OrderID", ASCENDING)],
+    "Highest price": [("Price", DESCENDING), ("OrderID", DESCENDING)],
+}
 
 # Initialize session state if not already set
-for key in ['user_type', 'user_id', 'user_name', 'authenticated', 'edit_mode', 'reset', 'submitted', 'add_mode', 'delete_mode']:
+for key in ['user_type', 'user_id', 'user_name', 'user_profile', 'authenticated', 'edit_mode', 'reset', 'submitted', 'add_mode', 'delete_mode', 'restock_mode']:
     if key not in st.session_state:
         st.session_state[key] = None
 
@@ -38,16 +114,26 @@ def handle_logout():
     st.session_state['user_type'] = None
     st.session_state['user_id'] = None
     st.session_state['user_name'] = None
+    st.session_state['user_profile'] = None
     st.session_state['reset'] = True
     st.session_state['edit_mode'] = False
     st.session_state['search'] = False
     st.session_state['order'] = False
     st.session_state['manage_books'] = False
     st.session_state['viewing_orders'] = False
+    st.session_state['analytics'] = False
     st.session_state['add_mode'] = False
     st.session_state['delete_mode'] = False
+    st.session_state['restock_mode'] = False
     st.session_state['submitted'] = False
-
+    st.session_state['browse_cursors'] = [None]
+    st.session_state['reviews_page'] = 0
+    st.session_state['orders_page'] = 0
+    st.session_state['pending_orders'] = {}
+    st.session_state['recommendations'] = None
+    st.session_state['order_history'] = None
+
+@counted
 def set_user_type(user_type):
     """ Set the type of user (Customer or Admin) """
     st.session_state['user_type'] = user_type
@@ -62,22 +148,32 @@ def login_user(user_id):
         st.session_state['order'] = st.session_state['user_type'] == "Customer"
         st.session_state['manage_books'] = st.session_state['user_type'] == "Admin"
         st.session_state['viewing_orders'] = False
+        st.session_state['analytics'] = False
         st.session_state['edit_mode'] = False
         st.session_state['add_mode'] = False
         st.session_state['delete_mode'] = False
+        st.session_state['restock_mode'] = False
     else:
         st.session_state['authenticated'] = False
         st.error("Invalid User ID")
 
 def authenticate_user(user_id, user_type):
     """ Check user credentials based on type """
-    user_id = int(user_id)
-    user = users_collection.find_one({"UserID": user_id, "UserType": user_type})
+    user = services.authenticate_user(db, user_id, user_type)
     if user:
+        # The profile is kept for the whole session and only refreshed by update_profile
+        st.session_state['user_profile'] = user
         st.session_state['user_name'] = user['Username']
         return True
     return False
 
+def load_user_profile():
+    """ Return the logged-in user's profile from session state, fetching it only if missing """
+    if st.session_state.get('user_profile') is None:
+        st.session_state['user_profile'] = services.authenticate_user(
+            db, st.session_state['user_id'], st.session_state['user_type'])
+    return st.session_state['user_profile']
+
 def create_account(user_type):
     """ Function to create a new customer or admin account without using a form """
     st.session_state['creating_account'] = True
@@ -97,7 +193,7 @@ def handle_account_creation(user_type, name, email, new_id):
     """ Function to handle the account creation process """
     try:
         new_id = int(new_id)  # Convert new_id to integer
-        if not users_collection.find_one({"UserID": new_id}):
+        if not services.user_exists(db, new_id):
             add_account(user_type, name, email, new_id)
         else:
             st.error("User ID already exists. Please choose a different ID.")
@@ -106,14 +202,7 @@ def handle_account_creation(user_type, name, email, new_id):
 
 def add_account(user_type, name, email, new_id):
     """ Function to create a new customer or admin account """
-    new_user = {
-        "UserID": int(new_id),  # Ensure new_id is already an integer here
-        "Username": name,
-        "Email": email,
-        "UserType": user_type
-    }
-    # Insert the new user into the database
-    users_collection.insert_one(new_user)
+    services.create_user(db, user_type, name, email, new_id)
     st.success(f"{user_type} account created successfully!")
     login_user(new_id)
 
@@ -130,50 +219,19 @@ def display_login_or_create():
 
 def update_profile(user_id, user_type, name, email):
     """ Update customer or admin profile information in MongoDB """
-    users_collection.update_one(
-        {"UserID": user_id, "UserType": user_type},
-        {"$set": {"Username": name, "Email": email}}
-    )
+    services.update_profile(db, user_id, user_type, name, email)
     st.session_state['user_name'] = name
+    st.session_state['user_profile'] = dict(st.session_state.get('user_profile') or {}, Username=name, Email=email)
 
-st.markdown("""
-    <style>
-    .book-card {
-        border: 2px solid #ccc;
-        border-radius: 10px;
-        padding: 20px;
-        margin: 10px;
-        box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-    }
-    .book-title {
-        font-size: 1.5em;
-        font-weight: bold;
-    }
-    .book-details {
-        font-size: 1em;
-        margin-bottom: 10px;
-    }
-    .order-card {
-        border: 1px solid #ddd;
-        border-radius: 8px;
-        padding: 15px;
-        margin: 10px;
-        box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-    }
-    .order-card h4 {
-        margin: 0 0 10px;
-    }
-    .order-card p {
-        margin: 5px 0;
-    }
-    </style>
-""", unsafe_allow_html=True)
+# Streamlit drops any element a rerun does not emit, so the minified stylesheet is sent each rerun
+st.markdown(CSS, unsafe_allow_html=True)
 
 def display_user_dashboard():
     """ Display user dashboard with options to edit profile, view books, and manage orders """
     
     if st.session_state.get('authenticated', False):
-        user_profile = users_collection.find_one({"UserID": int(st.session_state['user_id']), "UserType": st.session_state['user_type']})
+        # Deferred until after login so the login page never waits on index builds
+        renumbered = setup_database()
         st.sidebar.write(f"Welcome, {st.session_state['user_name']}")
         
         # Sidebar buttons
@@ -182,10 +240,12 @@ def display_user_dashboard():
                 'search': st.session_state['user_type'] == "Customer",
                 'order': st.session_state['user_type'] == "Customer",
                 'manage_books': st.session_state['user_type'] == "Admin",
+                'analytics': False,
                 'viewing_orders': False,
                 'edit_mode': False,
                 'add_mode': False,
                 'delete_mode': False,
+                'restock_mode': False,
                 'reviews': False
             })
         
@@ -195,9 +255,11 @@ def display_user_dashboard():
                 'search': False,
                 'order': False,
                 'manage_books': False,
+                'analytics': False,
                 'viewing_orders': False,
                 'add_mode': False,
                 'delete_mode': False,
+                'restock_mode': False,
                 'reviews': False
             })
 
@@ -207,12 +269,28 @@ def display_user_dashboard():
                 'search': False,
                 'order': False,
                 'manage_books': False,
+                'analytics': False,
                 'edit_mode': False,
                 'add_mode': False,
                 'delete_mode': False,
+                'restock_mode': False,
+                'reviews': False,
+                'order_history': None  # Reload the customer's history from the newest order
+            })
+
+        if st.session_state['user_type'] == "Admin" and st.sidebar.button("Sales Analytics", key="analytics_button"):
+            st.session_state.update({
+                'analytics': True,
+                'search': False,
+                'order': False,
+                'manage_books': False,
+                'viewing_orders': False,
+                'edit_mode': False,
+                'add_mode': False,
+                'delete_mode': False,
+                'restock_mode': False,
                 'reviews': False
             })
-            manage_orders(st.session_state['user_id'])
 
         if st.sidebar.button("Reviews", key="reviews_button"):
             st.session_state.update({
@@ -220,17 +298,27 @@ def display_user_dashboard():
                 'search': False,
                 'order': False,
                 'manage_books': False,
+                'analytics': False,
                 'viewing_orders': False,
                 'edit_mode': False,
                 'add_mode': False,
-                'delete_mode': False
+                'delete_mode': False,
+                'restock_mode': False
             })
 
         if st.sidebar.button("Logout", key="logout_button"):
             handle_logout()
             return  # Exit the function early to prevent further rendering
 
+        if st.session_state['user_type'] == "Admin":
+            stats = catalog_cache_stats()
+            st.sidebar.caption(f"Catalog cache: {stats['hits']} hits / {stats['misses']} misses")
+            for name, changes in renumbered.items():
+                st.sidebar.warning(f"{len(changes)} {name} had a repeated ID and were renumbered: "
+                                   + ", ".join(f"{old} -> {new}" for old, new in changes[:10]))
+
         if st.session_state.get('edit_mode', False):
+            user_profile = load_user_profile()
             new_name = st.text_input("Name", value=user_profile['Username'], key="name_input")
             new_email = st.text_input("Email", value=user_profile['Email'], key="email_input")
             if st.button("Save Changes", key="save_changes_button"):
@@ -239,51 +327,38 @@ def display_user_dashboard():
                 st.success("Profile updated successfully!")
             return  # Stop further rendering after editing profile
 
+        # A placed order clears the cached order history, so statuses are shown before the history renders
+        if st.session_state['user_type'] == "Customer":
+            display_order_statuses()
+
+        if st.session_state.get('viewing_orders', False):
+            manage_orders(st.session_state['user_id'])
+
         # Display the Customer or Admin dashboard based on user type
         if st.session_state['user_type'] == "Customer":
-            
             if st.session_state.get('search', False):
                 search_term = st.text_input("Enter search term", key="search_term_input")
-                search_by = st.radio("Search by", options=["genre", "author", "publisher"], key="search_by_radio")
+                search_by = st.radio("Search by", options=["title", "genre", "author", "publisher"], key="search_by_radio")
+                sort_by = st.radio("Sort by", options=["relevance", "rating"], horizontal=True, key="sort_by_radio")
                 search_active = bool(search_term)
 
                 if search_active:
-                    search_results = search_books(search_term, search_by)
+                    # The search index is built from a cached snapshot, so stock is read live
+                    search_results = services.with_live_stock(db, search_books(search_term, search_by, sort_by))
+                    ratings = cached_rating_summaries()
                     if search_results:
                         st.subheader("Search Results")
                         cols = st.columns(3)
                         for index, book in enumerate(search_results):
                             with cols[index % 3]:
-                                st.markdown(f"""
-                                    <div class="book-card">
-                                        <div class="book-title">{book['title']}</div>
-                                        <div class="book-details">Author: {book['author']}</div>
-                                        <div class="book-details">Price: ${book['price']}</div>
-                                        <div class="book-details">Genre: {book['genre']}</div>
-                                        <div class="book-details">Published Year: {book['published_year']}</div>
-                                        <div class="book-details">Publisher: {book['publisher']}</div>
-                                    </div>
-                                """, unsafe_allow_html=True)
-                                if st.button("Order Book", key=f"order_{book['BookID']}_search"):
-                                    order_book(st.session_state['user_id'], book['BookID'], book['price'])
+                                st.markdown(book_card_html(book, ratings.get(book['BookID'])), unsafe_allow_html=True)
+                                st.button("Order Book", key=f"order_{book['BookID']}_search", on_click=order_book,
+                                          args=(book, order_button_key(book['BookID'])))
                     else:
                         st.warning("No books found.")
                 else:
-                    cols = st.columns(3)
-                    for index, book in enumerate(books_data):
-                        with cols[index % 3]:
-                            st.markdown(f"""
-                                <div class="book-card">
-                                    <div class="book-title">{book['title']}</div>
-                                    <div class="book-details">Author: {book['author']}</div>
-                                    <div class="book-details">Price: ${book['price']}</div>
-                                    <div class="book-details">Genre: {book['genre']}</div>
-                                    <div class="book-details">Published Year: {book['published_year']}</div>
-                                    <div class="book-details">Publisher: {book['publisher']}</div>
-                                </div>
-                            """, unsafe_allow_html=True)
-                            if st.button(f"Order Book {book['BookID']}", key=f"order_{book['BookID']}_display"):
-                                order_book(st.session_state['user_id'], book['BookID'], book['price'])
+                    display_recommendations()
+                    display_books_page()
 
             if st.session_state.get('reviews', False):
                 display_reviews(st.session_state['user_id'])
@@ -292,44 +367,191 @@ def display_user_dashboard():
         elif st.session_state['user_type'] == "Admin":
             if st.session_state.get('manage_books', False):
                 st.subheader("Manage Books:")
-                cols = st.columns(2)
+                cols = st.columns(4)
 
                 with cols[0]:
                     if st.button("Delete Books", key="delete_books_button"):
                         st.session_state['delete_mode'] = True
                         st.session_state['add_mode'] = False  # Ensure add mode is turned off
+                        st.session_state['restock_mode'] = False
 
                 with cols[1]:
                     if st.button("Add Books", key="add_books_button"):
                         st.session_state['add_mode'] = True
                         st.session_state['delete_mode'] = False  # Ensure delete mode is turned off
+                        st.session_state['restock_mode'] = False
+
+                with cols[2]:
+                    if st.button("Restock Books", key="restock_books_button"):
+                        st.session_state['restock_mode'] = True
+                        st.session_state['add_mode'] = False
+                        st.session_state['delete_mode'] = False
+
+                with cols[3]:
+                    if st.button("Rebuild Ratings", key="rebuild_ratings_button"):
+                        rebuilt = rebuild_ratings(db)
+                        invalidate_collection("Ratings")
+                        st.success(f"Rebuilt rating summaries for {rebuilt} books.")
 
                 if st.session_state.get('delete_mode', False):
                     delete_books()
 
                 if st.session_state.get('add_mode', False):
                     add_book()
+
+                if st.session_state.get('restock_mode', False):
+                    restock_books()
             
+            if st.session_state.get('analytics', False):
+                display_sales_analytics()
+
             if st.session_state.get('reviews', False):
                 display_reviews(st.session_state['user_id'])
 
-def search_books(search_term, search_by):
+@counted
+def next_books_page(last_book_id):
+    """ Move the browse view to the page after the given BookID """
+    st.session_state['browse_cursors'].append(last_book_id)
+
+@counted
+def previous_books_page():
+    """ Move the browse view back one page """
+    if len(st.session_state['browse_cursors']) > 1:
+        st.session_state['browse_cursors'].pop()
+
+def display_recommendations():
+    """ Display books bought by readers of the customer's latest order, kept for the session """
+    if st.session_state.get('recommendations') is None:
+        st.session_state['recommendations'] = services.fetch_recommendations(db, st.session_state['user_id'])
+    latest, books = st.session_state['recommendations']
+    if latest is None or not books:
+        return
+    # The books are kept for the session, so their stock is read live
+    books = services.with_live_stock(db, books)
+    st.subheader(f"Readers of '{latest['title']}' also bought")
+    ratings = rating_summaries(ratings_collection, [book['BookID'] for book in books])
+    cols = st.columns(3)
+    for index, book in enumerate(books):
+        with cols[index % 3]:
+            st.markdown(book_card_html(book, ratings.get(book['BookID'])), unsafe_allow_html=True)
+            st.button("Order Book", key=f"order_{book['BookID']}_recommended", on_click=order_book,
+                      args=(book, order_button_key(book['BookID'])))
+
+def display_books_page():
+    """ Display the current page of the book grid with navigation controls """
+    if not st.session_state.get('browse_cursors'):
+        st.session_state['browse_cursors'] = [None]
+    cursors = st.session_state['browse_cursors']
+    books, has_next = services.fetch_books_page(db, cursors[-1])
+    ratings = rating_summaries(ratings_collection, [book['BookID'] for book in books])
+
+    cols = st.columns(3)
+    for index, book in enumerate(books):
+        with cols[index % 3]:
+            st.markdown(book_card_html(book, ratings.get(book['BookID'])), unsafe_allow_html=True)
+            st.button(f"Order Book {book['BookID']}", key=f"order_{book['BookID']}_display", on_click=order_book,
+                      args=(book, order_button_key(book['BookID'])))
+
+    nav = st.columns([1, 2, 1])
+    with nav[0]:
+        st.button("Previous", key="books_previous_button", on_click=previous_books_page,
+                  disabled=len(cursors) == 1)
+    with nav[1]:
+        st.write(f"Page {len(cursors)}")
+    with nav[2]:
+        st.button("Next", key="books_next_button", on_click=next_books_page,
+                  args=(books[-1]['BookID'] if books else None,), disabled=not has_next)
+
+@st.cache_resource
+def get_search_index_holder():
+    """ Process-wide holder for the catalog search index """
+    return {"index": None, "lock": threading.Lock()}
+
+def get_search_index():
+    """ Return the search index, rebuilding it when the cached Books snapshot changes """
+    books = load_collection("Books")
+    holder = get_search_index_holder()
+    with holder['lock']:
+        if holder['index'] is None or holder['index']['books'] is not books:
+            holder['index'] = build_search_index(books)
+        return holder['index']
+
+def cached_rating_summaries():
+    """ Return a BookID -> rating summary map built from the cached Ratings collection """
+    return {summary['BookID']: summary for summary in load_collection("Ratings")}
+
+def search_books(search_term, search_by, sort_by="relevance"):
     """ Search for books based on search term and search by criteria """
-    query = {search_by: {"$regex": search_term, "$options": "i"}}
-    return list(books_collection.find(query))
+    ratings = cached_rating_summaries() if sort_by == "rating" else None
+    return services.search_books(get_search_index(), search_term, search_by, sort_by, ratings,
+                                 limit=SEARCH_RESULT_LIMIT)
+
+def parse_book_ids(text):
+    """ Parse comma or whitespace separated BookIDs, raising ValueError on anything else """
+    try:
+        return {int(part) for part in text.replace(",", " ").split()}
+    except ValueError:
+        raise ValueError("BookIDs must be whole numbers separated by commas!")
+
+@st.cache_resource
+def get_title_map_holder():
+    """ Process-wide holder for the BookID -> title map used by order cards """
+    return {"books": None, "titles": {}, "lock": threading.Lock()}
+
+def book_titles(book_ids):
+    """ Return the BookID -> title map, rebuilt when the cached Books snapshot changes
+
+    Deleted books are not in the snapshot, so any of the given books that are missing are
+    fetched in one query and remembered.
+    """
+    books = load_collection("Books")
+    holder = get_title_map_holder()
+    with holder['lock']:
+        if holder['books'] is not books:
+            holder['books'] = books
+            holder['titles'] = {book['BookID']: book['title'] for book in books}
+        titles = holder['titles']
+        missing = {book_id for book_id in book_ids if book_id not in titles}
+    if missing:
+        found = services.fetch_book_titles(db, missing)
+        with holder['lock']:
+            titles.update({book_id: found.get(book_id) for book_id in missing})
+    return titles
+
+@counted
+def delete_selected_books(book_ids):
+    """ Soft-delete the ticked search matches plus any listed BookIDs; the delete button's callback """
+    try:
+        selected = parse_book_ids(st.session_state.get('delete_ids_input', ""))
+    except ValueError as error:
+        st.error(str(error))
+        return
+    selected.update(book_id for book_id in book_ids if st.session_state.get(f"delete_book_{book_id}"))
+    if not selected:
+        st.error("Select at least one book to delete!")
+        return
+    deleted = services.delete_books(db, selected)
+    invalidate_collection("Books")
+    # Reviews, ratings and recommendations of the deleted books are removed in the background
+    start_cleanup(db, selected)
+    for book_id in book_ids:
+        st.session_state[f"delete_book_{book_id}"] = False
+    st.session_state['delete_ids_input'] = ""
+    st.success(f"Deleted {deleted} books.")
 
 def delete_books():
-    """Function to delete books from the database"""
-    for book in books_data:
-        cols = st.columns([1, 2, 1])
-        with cols[1]:
-            st.write(f"Title: {book['title']} | Author: {book['author']}")
-        with cols[2]:
-            if st.button(f"Delete Book {book['BookID']}", key=str(book['BookID'])):
-                # Delete book from MongoDB
-                books_collection.delete_one({"BookID": book['BookID']})
-                st.success("Book deleted successfully!")
-                st.session_state["deleted"] = True
+    """ Display a title search and BookID list for deleting many books in one update """
+    st.subheader("Delete Books")
+    term = st.text_input("Find books by title", key="delete_search_input")
+    matches = search_books(term, "title") if term else []
+    for book in matches:
+        st.checkbox(f"{book['title']} | {book['author']} (Book ID {book['BookID']})",
+                    key=f"delete_book_{book['BookID']}")
+    if term and not matches:
+        st.warning("No books found.")
+    st.text_input("Or enter BookIDs, separated by commas", key="delete_ids_input")
+    st.button("Delete Selected Books", key="delete_selected_button", on_click=delete_selected_books,
+              args=([book['BookID'] for book in matches],))
 
 def add_book():
     """Function to add books to the database"""  
@@ -345,88 +567,279 @@ def add_book():
         if not all([book_title, book_author, book_price, book_genre, 
                     book_year, book_publisher]):
             st.error("All fields must be filled!")
-        # Check if the book already exists
-        elif books_collection.find_one({"title": book_title}):
-            st.error("A book with this title already exists!")
         else:
-            new_book_id = books_collection.count_documents({}) + 1
-            new_book = {
-                "BookID": int(new_book_id),
-                "title": book_title,
-                "author": book_author,
-                "price": book_price,
-                "genre": book_genre,
-                "published_year": int(book_year),
-                "publisher": book_publisher
-            }
-            books_collection.insert_one(new_book)
-            st.success(f"Book '{book_title}' added successfully!")
+            try:
+                services.add_book(db, book_title, book_author, book_price, book_genre,
+                                  book_year, book_publisher)
+            except ValueError as error:
+                st.error(str(error))
+            else:
+                invalidate_collection("Books")
+                st.success(f"Book '{book_title}' added successfully!")
+
+    st.subheader("Bulk Import")
+    uploaded = st.file_uploader("Books file (JSON, NDJSON or CSV)", type=["json", "ndjson", "jsonl", "csv"],
+                                key="bulk_import_uploader")
+    if uploaded and st.button("Import Books", key="bulk_import_button"):
+        # Imported here so the interface does not load the import machinery until an admin needs it
+        from bulk_io import detect_format, import_documents, iter_documents
+        stream = io.TextIOWrapper(uploaded, encoding="utf-8", newline="")
+        try:
+            stats = import_documents(db, "Books", iter_documents(stream, detect_format(uploaded.name)))
+        except ValueError as error:
+            # Batches before the bad document are already stored
+            invalidate_collection("Books")
+            st.error(f"Import stopped: {error}")
+            return
+        invalidate_collection("Books")
+        st.success(f"Imported {stats['read']} books ({stats['upserted']} new, {stats['modified']} updated) "
+                   f"in {stats['seconds']:.2f}s.")
+        if stats['skipped_titles']:
+            st.warning(f"Skipped duplicate titles: {', '.join(stats['skipped_titles'])}")
+
+def parse_restock_lines(text):
+    """ Parse "BookID, quantity" lines into a BookID -> units map, raising ValueError on a bad line """
+    quantities = {}
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            book_id, units = (int(part) for part in line.split(","))
+        except ValueError:
+            raise ValueError(f"Line {number} must be 'BookID, quantity': {line.strip()}")
+        if units <= 0:
+            raise ValueError(f"Line {number} must add a positive quantity: {line.strip()}")
+        quantities[book_id] = quantities.get(book_id, 0) + units
+    return quantities
+
+def restock_books():
+    """ Add stock for many books at once and fulfil their backorders """
+    st.subheader("Restock Books")
+    lines = st.text_area("One 'BookID, quantity' per line", key="restock_input")
+    if st.button("Restock", key="restock_button"):
+        try:
+            quantities = parse_restock_lines(lines)
+        except ValueError as error:
+            st.error(str(error))
+            return
+        if not quantities:
+            st.error("Enter at least one book to restock!")
+            return
+        fulfilled = restock(db, quantities)
+        invalidate_collection("Books")
+        st.success(f"Restocked {len(quantities)} books and fulfilled {sum(fulfilled.values())} backorders.")
+
+def update_order_status(query, new_status):
+    """ Move every order matching the query to the new status; backorders move only as stock allows """
+    return services.update_order_status(db, query, new_status)
+
+@counted
+def reset_orders_page():
+    """ Return the admin order view to its first page after a filter change """
+    st.session_state['orders_page'] = 0
+
+@counted
+def change_orders_page(step):
+    """ Move the admin order view forward or back by the given number of pages """
+    st.session_state['orders_page'] = max(0, st.session_state.get('orders_page', 0) + step)
+
+@counted
+def apply_status_to_selected(order_ids):
+    """ Apply the chosen bulk status to the orders ticked on the current page """
+    selected = [order_id for order_id in order_ids if st.session_state.get(f"select_order_{order_id}")]
+    if not selected:
+        st.warning("Select at least one order.")
+        return
+    new_status = st.session_state['bulk_status_select']
+    updated = update_order_status({"OrderID": {"$in": selected}}, new_status)
+    for order_id in selected:
+        st.session_state[f"select_order_{order_id}"] = False
+    st.success(f"Marked {updated} orders as {new_status}.")
+
+@counted
+def apply_status_to_matching(query):
+    """ Apply the chosen bulk status to every order matching the current filters """
+    if not query:
+        st.warning("Set at least one filter before updating all matching orders.")
+        return
+    new_status = st.session_state['bulk_status_select']
+    updated = update_order_status(query, new_status)
+    st.success(f"Marked {updated} orders as {new_status}.")
+
+def parse_optional_id(value, label):
+    """ Convert an optional ID filter to an int, reporting invalid input """
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        st.error(f"Invalid {label}. Please enter a numeric value.")
+        return None
+
+def display_admin_orders():
+    """ Display orders for admins with filters, sorting, pagination and bulk status changes """
+    filters = st.columns(4)
+    with filters[0]:
+        statuses = st.multiselect("Status", ORDER_STATUSES, key="orders_status_filter", on_change=reset_orders_page)
+    with filters[1]:
+        date_range = st.date_input("Order date", value=(), key="orders_date_filter", on_change=reset_orders_page)
+    with filters[2]:
+        user_filter = st.text_input("User ID", key="orders_user_filter", on_change=reset_orders_page)
+    with filters[3]:
+        book_filter = st.text_input("Book ID", key="orders_book_filter", on_change=reset_orders_page)
+    sort_label = st.selectbox("Sort by", list(ORDER_SORTS), key="orders_sort_select", on_change=reset_orders_page)
+
+    query = services.build_order_query(statuses, date_range, parse_optional_id(user_filter, "User ID"),
+                              parse_optional_id(book_filter, "Book ID"))
+    page = st.session_state.get('orders_page') or 0
+    orders, has_next = services.fetch_orders_page(db, query, ORDER_SORTS[sort_label], page)
+
+    if not orders:
+        st.write("No orders found.")
+
+    titles = book_titles(order['BookID'] for order in orders)
+    cols = st.columns(2)
+    for index, order in enumerate(orders):
+        with cols[index % 2]:
+            st.markdown(order_card_html(order, titles.get(order['BookID'])), unsafe_allow_html=True)
+            st.checkbox("Select", key=f"select_order_{order['OrderID']}")
+
+    nav = st.columns([1, 2, 1])
+    with nav[0]:
+        st.button("Previous", key="orders_previous_button", on_click=change_orders_page,
+                  args=(-1,), disabled=page == 0)
+    with nav[1]:
+        st.write(f"Page {page + 1}")
+    with nav[2]:
+        st.button("Next", key="orders_next_button", on_click=change_orders_page,
+                  args=(1,), disabled=not has_next)
+
+    st.subheader("Update Status")
+    bulk = st.columns(3)
+    with bulk[0]:
+        st.selectbox("New status", SETTABLE_STATUSES, key="bulk_status_select")
+    with bulk[1]:
+        st.button("Apply to selected", key="apply_selected_button", on_click=apply_status_to_selected,
+                  args=([order['OrderID'] for order in orders],))
+    with bulk[2]:
+        # Without a filter this would update every order in the store
+        st.button("Apply to all matching", key="apply_matching_button", on_click=apply_status_to_matching,
+                  args=(query,), disabled=not query, help="Set at least one filter first")
 
 def manage_orders(user_id):
     """Function to manage orders based on user type"""
     st.header("Orders")
-    # Create two columns for the grid layout
-    cols = st.columns(2)
 
     if st.session_state['user_type'] == "Admin":
-        orders = list(orders_collection.find())
-        
-    elif st.session_state['user_type'] == "Customer":
-        user_id = int(user_id)
-        orders = list(orders_collection.find({"UserID": user_id}))
-        if not orders:
-            st.write("No orders found.")  # Message if no orders are present
-    
-    for index, order in enumerate(orders):
-        col = cols[index % 2]
-
+        display_admin_orders()
+        return
+
+    history = st.session_state.get('order_history')
+    if history is None:
+        orders, has_more = services.fetch_user_orders(db, user_id)
+        history = st.session_state['order_history'] = {"orders": orders, "has_more": has_more}
+    orders = history['orders']
+    if not orders:
+        st.write("No orders found.")  # Message if no orders are present
+
+    # Create two columns for the grid layout, one element per column rather than one per order
+    titles = book_titles(order['BookID'] for order in orders)
+    cols = st.columns(2)
+    for index, col in enumerate(cols):
         with col:
-            st.markdown(f"""
-                <div class="order-card">
-                    <h4>Order ID: {order.get('OrderID', 'N/A')}</h4>
-                    <p><strong>Book ID:</strong> {order.get('BookID', 'N/A')}</p>
-                    <p><strong>Price:</strong> ${order.get('Price', 'N/A')}</p>
-                    <p><strong>Order Date:</strong> {order.get('OrderDate', 'N/A')}</p>
-                    <p><strong>Status:</strong> {order.get('OrderStatus', 'N/A')}</p>
-                </div>
-            """, unsafe_allow_html=True)
-
-def order_book(user_id, book_id, price):
-    """ Function to order a book """
-    new_order_id = orders_collection.count_documents({}) + 1
-    id = int(user_id)
-    today = date.today()
-    new_order = {
-        "OrderID": new_order_id,
-        "UserID": id,
-        "OrderDate": today.strftime('%Y-%m-%d'),
-        "BookID": book_id,
-        "Price": price,
-        "OrderStatus": 'Processing'
-    }
-    orders_collection.insert_one(new_order)  # Insert new order into MongoDB
-    st.success("Book ordered successfully!")
+            st.markdown(order_cards_html(orders[index::2], titles), unsafe_allow_html=True)
+    if history['has_more']:
+        st.button("Load more orders", key="load_more_orders_button", on_click=load_more_orders, args=(user_id,))
+
+@counted
+def load_more_orders(user_id):
+    """ Append the next page of the customer's order history; the load more button's callback """
+    history = st.session_state.get('order_history')
+    if not history or not history['orders']:
+        return  # The history was cleared by a new order; the rerun reloads its first page
+    last = history['orders'][-1]
+    orders, has_more = services.fetch_user_orders(db, user_id, after=(last['OrderDate'], last['OrderID']))
+    history['orders'].extend(orders)
+    history['has_more'] = has_more
+
+@st.cache_resource
+def get_order_queue():
+    """ Process-wide write-behind queue that places orders in batches """
+    return OrderQueue(db)
+
+def order_button_key(book_id):
+    """ Return the idempotency key that the next click on a book's order button will use """
+    state_key = f"order_key_{book_id}"
+    if state_key not in st.session_state:
+        st.session_state[state_key] = uuid.uuid4().hex
+    return st.session_state[state_key]
+
+@counted
+def order_book(book, key):
+    """ Submit an order to the write-behind queue; the order buttons' callback """
+    # The key was fixed when the button rendered, so double clicks and replays submit it again
+    get_order_queue().submit(st.session_state['user_id'], book['BookID'], book['price'], key)
+    if st.session_state.get(f"order_key_{book['BookID']}") == key:
+        # The next click on this book is a new order
+        del st.session_state[f"order_key_{book['BookID']}"]
+    if not st.session_state.get('pending_orders'):
+        st.session_state['pending_orders'] = {}
+    st.session_state['pending_orders'][key] = book['title']
+
+def display_order_statuses():
+    """ Show the progress of orders submitted in this session """
+    pending = st.session_state.get('pending_orders') or {}
+    order_queue = get_order_queue()
+    for key, title in list(pending.items()):
+        status = order_queue.status(key)
+        if status is None:
+            del pending[key]
+        elif status['status'] == PLACED and status['OrderStatus'] == BACKORDERED:
+            st.warning(f"'{title}' is out of stock, so it was backordered. Order ID: {status['OrderID']}")
+            del pending[key]
+            st.session_state['recommendations'] = None
+            st.session_state['order_history'] = None
+        elif status['status'] == PLACED:
+            st.success(f"'{title}' ordered successfully! Order ID: {status['OrderID']}")
+            del pending[key]
+            st.session_state['recommendations'] = None
+            st.session_state['order_history'] = None
+        elif status['status'] == FAILED:
+            st.error(f"Ordering '{title}' failed: {status['error']}")
+            del pending[key]
+        else:
+            st.info(f"Placing your order for '{title}'...")
+    if pending:
+        st.button("Refresh order status", key="refresh_orders_button")
+
+@counted
+def change_reviews_page(step):
+    """ Move the reviews view forward or back by the given number of pages """
+    st.session_state['reviews_page'] = max(0, st.session_state.get('reviews_page', 0) + step)
 
 def display_reviews(user_id):
-    """ Display reviews for books """
+    """ Display reviews grouped by book, one page of books at a time """
     st.header("Book Reviews")
-    user_id = int(user_id)
-    book_ids = [book['BookID'] for book in books_data]
-    reviews = list(reviews_collection.find({"BookID": {"$in": book_ids}}))
-    
-    if not reviews:
+    page = st.session_state.get('reviews_page') or 0
+    groups, has_next = services.fetch_review_groups(db, page)
+
+    if not groups:
         st.write("No reviews available.")
-    
-    for review in reviews:
-        book = books_collection.find_one({"BookID": review['BookID']})
-        st.markdown(f"""
-            <div class="order-card">
-                <h4>Book: {book['title']}</h4>
-                <p><strong>Rating:</strong> {review.get('Rating', 'N/A')}</p>
-                <p><strong>Comment:</strong> {review.get('Comment', 'N/A')}</p>
-                <p><strong>Date:</strong> {review.get('ReviewDate', 'N/A')}</p>
-            </div>
-        """, unsafe_allow_html=True)
+
+    for group in groups:
+        st.subheader(f"{group['title']} ({group['average']:.1f} / 5 from {group['count']} reviews)")
+        if group['reviews']:
+            st.markdown(review_cards_html(group['reviews']), unsafe_allow_html=True)
+
+    nav = st.columns([1, 2, 1])
+    with nav[0]:
+        st.button("Previous", key="reviews_previous_button", on_click=change_reviews_page,
+                  args=(-1,), disabled=page == 0)
+    with nav[1]:
+        st.write(f"Page {page + 1}")
+    with nav[2]:
+        st.button("Next", key="reviews_next_button", on_click=change_reviews_page,
+                  args=(1,), disabled=not has_next)
 
 def add_review(user_id):
     """ Add a review for a book """
@@ -434,7 +847,7 @@ def add_review(user_id):
     st.subheader("Add Review")
     user_id = int(user_id)
     # Fetch books and display them with titles and IDs
-    books = books_collection.find()
+    books = load_collection("Books")
     book_options = [(book['title'], book['BookID']) for book in books]
     selected_book_title, selected_book_id = st.selectbox("Select Book", options=book_options, format_func=lambda x: f"{x[0]}")
     
@@ -446,21 +859,70 @@ def add_review(user_id):
     
     if st.button("Submit Review"):
         if selected_book_id and comment:
-            new_review_id = reviews_collection.count_documents({}) + 1
-            today = date.today()
-            new_review = {
-                "ReviewID": new_review_id,
-                "BookID": selected_book_id,
-                "UserID": user_id,
-                "Rating": rating,
-                "Comment": comment,
-                "ReviewDate": today.strftime('%Y-%m-%d')
-            }
-            reviews_collection.insert_one(new_review)
+            services.add_review(db, user_id, selected_book_id, rating, comment)
+            invalidate_collection("Ratings")
             st.success("Review added successfully!")
         else:
             st.error("Please fill out all fields.")
 
+def sales_table(rollups, label):
+    """ Format rollups as rows for a sales table """
+    return [{label: rollup.get('Title', rollup['Key']), "Orders": rollup['Orders'],
+             "Revenue": round(rollup['Revenue'], 2)} for rollup in rollups]
+
+def display_sales_analytics():
+    """ Display sales reports served from the precomputed rollups """
+    st.header("Sales Analytics")
+    statuses = orders_by_status(db)
+    days = revenue_by_day(db, ANALYTICS_DAYS)
+    genres = top_sales(db, GENRE, ANALYTICS_TOP)
+
+    cols = st.columns(3)
+    cols[0].metric("Orders", sum(statuses.values()))
+    cols[1].metric(f"Revenue (last {ANALYTICS_DAYS} sales days)", f"${sum(day['Revenue'] for day in days):,.2f}")
+    cols[2].metric("Backordered", statuses.get(BACKORDERED, 0))
+
+    st.subheader("Revenue per Day")
+    if days:
+        st.line_chart({"Day": [day['Key'] for day in days], "Revenue": [day['Revenue'] for day in days]},
+                      x="Day", y="Revenue")
+    else:
+        st.write("No sales yet.")
+
+    cols = st.columns(2)
+    with cols[0]:
+        st.subheader("Top Books")
+        st.dataframe(sales_table(top_sales(db, BOOK, ANALYTICS_TOP), "Title"))
+        st.subheader("Orders by Status")
+        st.dataframe([{"Status": status, "Orders": count} for status, count in sorted(statuses.items())])
+    with cols[1]:
+        st.subheader("Top Genres")
+        st.dataframe(sales_table(genres, "Genre"))
+        st.subheader("Top Publishers")
+        st.dataframe(sales_table(top_sales(db, PUBLISHER, ANALYTICS_TOP), "Publisher"))
+
+    if st.button("Rebuild Analytics", key="rebuild_analytics_button"):
+        rebuilt = rebuild_sales(db)
+        st.success(f"Rebuilt {rebuilt} sales rollups from all orders.")
+
+def display_debug_panel(stats):
+    """ Display query counts, timings and repeated query shapes for the rerun that just finished """
+    with st.expander("Debug: this rerun", expanded=True):
+        cols = st.columns(4)
+        cols[0].metric("Queries", stats['query_count'])
+        cols[1].metric("DB time", f"{stats['db_ms']:.1f} ms")
+        cols[2].metric("Render time", f"{stats['render_ms']:.1f} ms")
+        cols[3].metric("Documents", stats['documents'])
+        for (collection, method, fields), count in repeated_queries(stats).items():
+            st.warning(f"Possible N+1: {collection}.{method}({fields}) ran {count} times")
+        cache = catalog_cache_stats()
+        st.caption(f"Catalog cache: {cache['hits']} hits / {cache['misses']} misses, "
+                   f"cached: {', '.join(cache['cached']) or 'nothing'}")
+        cards = card_cache_stats()
+        st.caption(f"Card cache: books {cards['book_hits']} hits / {cards['book_misses']} misses, "
+                   f"orders {cards['order_hits']} hits / {cards['order_misses']} misses")
+        st.dataframe(stats['queries'])
+
 # User Interface
 st.title("Bookstore Management System")
 
@@ -480,3 +942,10 @@ if not st.session_state.get('authenticated', False):
         display_login_or_create()
 else:
     display_user_dashboard()
+
+# Close the rerun's query statistics before rendering the debug panel
+rerun_stats = finish_rerun()
+st.session_state['last_rerun_stats'] = rerun_stats
+if st.session_state.get('authenticated') and st.session_state.get('user_type') == "Admin":
+    if st.sidebar.checkbox("Show debug panel", key="debug_panel_checkbox"):
+        display_debug_panel(rerun_stats)
@@ -0,0 +1,213 @@
+""" Query counting, timing and slow-query logging for every MongoDB call the app makes
+
+final.py wraps its database with instrument_database() and brackets each Streamlit rerun
+with start_rerun() and finish_rerun(). Widget callbacks run before the script body, so they call
+start_callback() and their queries are counted with the rerun they trigger. Queries are logged as JSON lines on the
+"bookstore.queries" logger: queries slower than BOOKSTORE_SLOW_QUERY_MS (default 100) at
+WARNING, and one summary per rerun at INFO. BOOKSTORE_QUERY_LOG_LEVEL sets the level (default WARNING).
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# Collection methods whose calls are counted and timed
+INSTRUMENTED_METHODS = ("find", "find_one", "count_documents", "aggregate", "insert_one", "insert_many",
+                        "update_one", "update_many", "delete_one", "delete_many", "find_one_and_update",
+                        "bulk_write", "create_index")
+
+# Methods whose first argument is a query filter
+FILTERED_METHODS = ("find", "find_one", "count_documents", "update_one", "update_many", "delete_one",
+                    "delete_many", "find_one_and_update")
+
+# Methods returning a cursor, whose round trips happen while the results are iterated
+CURSOR_METHODS = ("find", "aggregate")
+
+# Cursor modifiers that return the cursor itself and so must keep returning the wrapper
+CURSOR_MODIFIERS = ("sort", "skip", "limit", "batch_size", "hint", "max_time_ms", "collation")
+
+SLOW_QUERY_MS = float(os.environ.get("BOOKSTORE_SLOW_QUERY_MS", 100))
+
+logger = logging.getLogger("bookstore.queries")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(os.environ.get("BOOKSTORE_QUERY_LOG_LEVEL", "WARNING").upper())
+    logger.propagate = False
+
+_current = threading.local()
+
+def _new_stats(in_callbacks=False):
+    _current.stats = {"started": time.perf_counter(), "queries": [], "db_ms": 0.0, "in_callbacks": in_callbacks}
+    return _current.stats
+
+def start_rerun():
+    """ Begin collecting query statistics for the rerun running on this thread
+
+    Statistics opened by this rerun's widget callbacks are kept, so their queries are counted.
+    """
+    stats = current_rerun()
+    if stats is not None and stats['in_callbacks']:
+        stats['in_callbacks'] = False
+        return stats
+    return _new_stats()
+
+def start_callback():
+    """ Begin or continue collecting statistics for the widget callbacks that start a rerun
+
+    Only call this from callbacks: they run on the script thread before the script body.
+    """
+    stats = current_rerun()
+    if stats is not None and stats['in_callbacks']:
+        return stats
+    return _new_stats(in_callbacks=True)
+
+def current_rerun():
+    """ Return the statistics being collected on this thread, or None outside a rerun """
+    return getattr(_current, "stats", None)
+
+def finish_rerun():
+    """ Close the current rerun, log its summary and return it as a plain dict """
+    stats = current_rerun()
+    if stats is None:
+        return None
+    _current.stats = None
+    total_ms = (time.perf_counter() - stats['started']) * 1000
+    summary = {
+        "event": "rerun",
+        "query_count": len(stats['queries']),
+        "db_ms": round(stats['db_ms'], 2),
+        "render_ms": round(total_ms - stats['db_ms'], 2),
+        "total_ms": round(total_ms, 2),
+        "documents": sum(query['documents'] for query in stats['queries']),
+        "queries": stats['queries'],
+    }
+    logger.info(json.dumps({key: value for key, value in summary.items() if key != "queries"}))
+    return summary
+
+def repeated_queries(summary, threshold=3):
+    """ Return (collection, method, filter keys) shapes issued at least threshold times in a rerun """
+    counts = {}
+    for query in summary['queries']:
+        shape = (query['collection'], query['method'], ",".join(query['filter']))
+        counts[shape] = counts.get(shape, 0) + 1
+    return {shape: count for shape, count in counts.items() if count >= threshold}
+
+def _filter_keys(method, args, kwargs):
+    """ Describe a call's filter by its field names, or a pipeline by its stage names, without values """
+    if method in FILTERED_METHODS:
+        query = args[0] if args else kwargs.get("filter")
+        return sorted(query) if isinstance(query, dict) else []
+    if method == "aggregate":
+        pipeline = args[0] if args else kwargs.get("pipeline", [])
+        return [next(iter(stage)) for stage in pipeline]
+    return []
+
+def _document_count(result):
+    """ Estimate how many documents a call returned or touched """
+    if result is None:
+        return 0
+    if isinstance(result, int):
+        return result
+    counts = [getattr(result, attribute, None)
+              for attribute in ("inserted_count", "upserted_count", "modified_count", "deleted_count")]
+    counts = [count for count in counts if isinstance(count, int)]
+    if counts:
+        return sum(counts)
+    inserted = getattr(result, "inserted_ids", None)
+    return len(inserted) if inserted is not None else 1
+
+def record_query(collection, method, filter_keys, elapsed_ms, documents):
+    """ Add one query to the current rerun and log it if it was slow """
+    query = {
+        "collection": collection,
+        "method": method,
+        "filter": filter_keys,
+        "ms": round(elapsed_ms, 2),
+        "documents": documents,
+    }
+    stats = current_rerun()
+    if stats is not None:
+        stats['queries'].append(query)
+        stats['db_ms'] += elapsed_ms
+    if elapsed_ms >= SLOW_QUERY_MS:
+        logger.warning(json.dumps(dict(query, event="slow_query")))
+
+class InstrumentedCursor:
+    """ Cursor wrapper that times the round trips made while its results are read """
+
+    def __init__(self, cursor, collection, method, filter_keys, elapsed=0.0):
+        self._cursor = cursor
+        self._collection = collection
+        self._method = method
+        self._filter_keys = filter_keys
+        self._elapsed = elapsed
+
+    def __getattr__(self, name):
+        attribute = getattr(self._cursor, name)
+        if name in CURSOR_MODIFIERS:
+            def modifier(*args, **kwargs):
+                attribute(*args, **kwargs)
+                return self
+            return modifier
+        return attribute
+
+    def __iter__(self):
+        iterator = iter(self._cursor)
+        elapsed, documents = self._elapsed, 0
+        try:
+            while True:
+                # Only time spent waiting on the cursor counts, not the caller's work between documents
+                started = time.perf_counter()
+                try:
+                    document = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - started
+                documents += 1
+                yield document
+        finally:
+            record_query(self._collection, self._method, self._filter_keys, elapsed * 1000, documents)
+
+class InstrumentedCollection:
+    """ Collection wrapper that records every instrumented method call """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name not in INSTRUMENTED_METHODS:
+            return attribute
+
+        def instrumented(*args, **kwargs):
+            filter_keys = _filter_keys(name, args, kwargs)
+            started = time.perf_counter()
+            result = attribute(*args, **kwargs)
+            elapsed = time.perf_counter() - started
+            if name in CURSOR_METHODS:
+                return InstrumentedCursor(result, self._collection.name, name, filter_keys, elapsed)
+            record_query(self._collection.name, name, filter_keys, elapsed * 1000, _document_count(result))
+            return result
+
+        return instrumented
+
+class InstrumentedDatabase:
+    """ Database wrapper whose collections are instrumented """
+
+    def __init__(self, db):
+        self._db = db
+
+    def __getitem__(self, name):
+        return InstrumentedCollection(self._db[name])
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+def instrument_database(db):
+    """ Wrap a database so every collection call is counted and timed """
+    return InstrumentedDatabase(db)
@@ -0,0 +1,81 @@
+""" Stock tracking for books, with atomic reservation and per-title backorders
+
+A book's available units are kept in its "stock" field, and every stock change bumps the
+book's "version" so cached cards are redrawn. Books without a stock field are not
+inventory-tracked and can always be ordered. Orders that find a tracked title sold out are
+stored as Backordered and fulfilled oldest first when the title is restocked.
+"""
+from pymongo import UpdateOne
+
+from analytics import record_status_change
+
+BACKORDERED = "Backordered"
+PROCESSING = "Processing"
+
+def reserve_stock(db, book_id, quantity=1):
+    """ Atomically take up to quantity units of a book and return how many were reserved """
+    books = db["Books"]
+    # The common case is one conditional update: it only matches while enough units remain
+    if books.update_one({"BookID": book_id, "stock": {"$gte": quantity}},
+                        {"$inc": {"stock": -quantity, "version": 1}}).modified_count:
+        return quantity
+    book = books.find_one({"BookID": book_id}, {"_id": 0, "stock": 1})
+    if book is None:
+        return 0
+    if "stock" not in book:
+        return quantity
+    # Fewer units than requested are left; take them one at a time
+    reserved = 0
+    while reserved < quantity and books.update_one({"BookID": book_id, "stock": {"$gte": 1}},
+                                                   {"$inc": {"stock": -1, "version": 1}}).modified_count:
+        reserved += 1
+    return reserved
+
+def release_stock(db, quantities):
+    """ Return reserved units to stock, given a BookID -> units map """
+    requests = [UpdateOne({"BookID": book_id, "stock": {"$exists": True}}, {"$inc": {"stock": units, "version": 1}})
+                for book_id, units in quantities.items() if units]
+    if requests:
+        db["Books"].bulk_write(requests, ordered=False)
+
+def fulfil_backorders(db, book_id):
+    """ Move the oldest backorders of a book to Processing while stock lasts and return how many moved """
+    waiting = [order['OrderID'] for order in db["Orders"].find(
+        {"BookID": book_id, "OrderStatus": BACKORDERED}, {"_id": 0, "OrderID": 1}
+    ).sort("OrderID", 1).limit(max(0, available_stock(db, book_id)))]
+    if not waiting:
+        return 0
+    reserved = reserve_stock(db, book_id, len(waiting))
+    moved = db["Orders"].update_many(
+        {"OrderID": {"$in": waiting[:reserved]}, "OrderStatus": BACKORDERED},
+        {"$set": {"OrderStatus": PROCESSING}}
+    ).modified_count
+    # Another restock may have fulfilled some of these orders first
+    release_stock(db, {book_id: reserved - moved})
+    record_status_change(db, {BACKORDERED: moved}, PROCESSING)
+    return moved
+
+def available_stock(db, book_id):
+    """ Return the units in stock for a tracked book, or 0 """
+    book = db["Books"].find_one({"BookID": book_id}, {"_id": 0, "stock": 1})
+    return (book or {}).get("stock", 0)
+
+def restock(db, quantities):
+    """ Add units for many books in one bulk write, then fulfil their backorders
+
+    quantities maps BookID -> units to add. Returns a BookID -> fulfilled backorders map.
+    """
+    requests = [UpdateOne({"BookID": book_id}, {"$inc": {"stock": units, "version": 1}})
+                for book_id, units in quantities.items() if units > 0]
+    if not requests:
+        return {}
+    db["Books"].bulk_write(requests, ordered=False)
+    return {book_id: fulfil_backorders(db, book_id) for book_id in quantities}
+
+def stock_label(book):
+    """ Format a book's stock for display, or an empty string for untracked books """
+    if "stock" not in book:
+        return ""
+    if book['stock'] > 0:
+        return f"In stock: {book['stock']}"
+    return "Out of stock - orders are backordered"
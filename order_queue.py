@@ -0,0 +1,97 @@
+""" Write-behind queue that places orders in batches on a background thread
+
+The web interface submits each order click with an idempotency key and polls its status.
+A click that is retried or replayed by a rerun reuses the key. The queue skips keys it has
+already seen, and the unique IdempotencyKey index on Orders catches retries across processes.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from services import place_orders
+
+QUEUED = "queued"
+PLACED = "placed"
+FAILED = "failed"
+
+logger = logging.getLogger("bookstore.orders")
+
+class OrderQueue:
+    """ Batches submitted orders into insert_many calls on a background thread """
+
+    def __init__(self, db, batch_size=100, flush_interval=0.05, status_capacity=10_000):
+        self._db = db
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._status_capacity = status_capacity
+        self._queue = queue.Queue()
+        self._statuses = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="order-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id, book_id, price, key):
+        """ Queue an order unless this key was already submitted, and return the key's status """
+        with self._lock:
+            # A failed key may be retried; any other known key is a duplicate submission
+            if key in self._statuses and self._statuses[key]['status'] != FAILED:
+                return self._statuses[key]['status']
+            self._set_status(key, {"status": QUEUED})
+        self._queue.put({"user_id": user_id, "book_id": book_id, "price": price, "key": key})
+        return QUEUED
+
+    def status(self, key):
+        """ Return the status of a submitted key as a dict, or None if it is unknown """
+        with self._lock:
+            status = self._statuses.get(key)
+            return dict(status) if status else None
+
+    def flush(self):
+        """ Block until every order submitted so far has been written """
+        self._queue.join()
+
+    def _set_status(self, key, status):
+        """ Record a status, forgetting the oldest keys beyond the capacity; call with the lock held """
+        self._statuses[key] = status
+        self._statuses.move_to_end(key)
+        while len(self._statuses) > self._status_capacity:
+            self._statuses.popitem(last=False)
+
+    def _next_batch(self):
+        """ Wait for one order, then gather more until the batch is full or the flush interval passes """
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._flush_interval
+        while len(batch) < self._batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                try:
+                    placed = place_orders(self._db, batch)
+                    statuses = {
+                        request['key']: dict(placed[request['key']], status=PLACED)
+                        if request['key'] in placed else {"status": FAILED, "error": "This book is no longer available"}
+                        for request in batch
+                    }
+                except Exception as error:
+                    # The thread serves every session, so no failure may end it; the keys can be retried
+                    logger.exception("Placing a batch of %d orders failed", len(batch))
+                    statuses = {request['key']: {"status": FAILED, "error": str(error)} for request in batch}
+                with self._lock:
+                    for key, status in statuses.items():
+                        self._set_status(key, status)
+            finally:
+                # flush() must return even if recording the statuses failed
+                for _ in batch:
+                    self._queue.task_done()
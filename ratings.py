@@ -0,0 +1,66 @@
+""" Materialized per-book rating summaries kept in the Ratings collection """
+from pymongo import ReplaceOne, ReturnDocument
+
+RATING_VALUES = (1, 2, 3, 4, 5)
+
+def empty_summary(book_id):
+    """ Return a summary for a book with no reviews """
+    return {
+        "BookID": book_id,
+        "count": 0,
+        "sum": 0,
+        "average": 0.0,
+        "histogram": {str(value): 0 for value in RATING_VALUES},
+    }
+
+def record_rating(ratings_collection, book_id, rating):
+    """ Fold one new review rating into the book's summary """
+    summary = ratings_collection.find_one_and_update(
+        {"BookID": book_id},
+        {"$inc": {"count": 1, "sum": rating, f"histogram.{rating}": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    # Only the writer that saw the latest count sets the average, so concurrent reviews cannot leave it stale
+    ratings_collection.update_one(
+        {"BookID": book_id, "count": summary['count']},
+        {"$set": {"average": summary['sum'] / summary['count']}}
+    )
+
+def rebuild_ratings(db):
+    """ Recompute every summary from the Reviews collection and return how many books have one """
+    summaries = {}
+    pipeline = [{"$group": {"_id": {"BookID": "$BookID", "Rating": "$Rating"}, "count": {"$sum": 1}}}]
+    for row in db["Reviews"].aggregate(pipeline):
+        book_id, rating = row['_id']['BookID'], row['_id']['Rating']
+        summary = summaries.setdefault(book_id, empty_summary(book_id))
+        summary['count'] += row['count']
+        summary['sum'] += rating * row['count']
+        summary['histogram'][str(rating)] = summary['histogram'].get(str(rating), 0) + row['count']
+
+    requests = []
+    for summary in summaries.values():
+        summary['average'] = summary['sum'] / summary['count']
+        requests.append(ReplaceOne({"BookID": summary['BookID']}, summary, upsert=True))
+    if requests:
+        db["Ratings"].bulk_write(requests, ordered=False)
+    db["Ratings"].delete_many({"BookID": {"$nin": list(summaries)}})
+    return len(summaries)
+
+def rating_summaries(ratings_collection, book_ids):
+    """ Return a BookID -> summary map for the given books in a single query """
+    return {
+        summary['BookID']: summary
+        for summary in ratings_collection.find({"BookID": {"$in": list(book_ids)}}, {"_id": 0})
+    }
+
+def rating_label(summary):
+    """ Format a summary for display on a book card """
+    if not summary or not summary.get('count'):
+        return "No ratings yet"
+    return f"{summary['average']:.1f} / 5 ({summary['count']} reviews)"
+
+if __name__ == "__main__":
+    from database import get_database
+    rebuilt = rebuild_ratings(get_database())
+    print(f"Rebuilt rating summaries for {rebuilt} books")
@@ -0,0 +1,150 @@
+""" Offline job that builds "readers also bought" recommendations from co-purchases and co-ratings
+
+Usage: python recommend.py [--top-k N] [--block-size N]
+
+Orders give a binary customer x book purchase matrix and Reviews a customer x book rating
+matrix, centred on each customer's mean rating. Two books are similar when the same customers
+bought them or rated them alike (cosine similarity of their columns, weighted by
+PURCHASE_WEIGHT and RATING_WEIGHT). The job keeps each book's top-k neighbours in the
+Recommendations collection, so the web interface needs one indexed lookup per book.
+
+Memory stays bounded on millions of orders. Interactions are streamed into typed arrays
+rather than documents, and similarities are computed for BLOCK_SIZE books at a time. The
+books x books matrix is never materialized. Requires numpy and scipy.
+"""
+import argparse
+import time
+import uuid
+from array import array
+
+import numpy as np
+from pymongo import ReplaceOne
+from scipy import sparse
+
+RECOMMENDATIONS = "Recommendations"
+
+# Neighbours kept per book, and books whose similarities are computed together
+TOP_K = 10
+BLOCK_SIZE = 512
+
+# Documents read per round trip and recommendations written per bulk write
+BATCH_SIZE = 10_000
+WRITE_BATCH_SIZE = 1_000
+
+# Relative weight of each signal in the combined similarity
+PURCHASE_WEIGHT = 1.0
+RATING_WEIGHT = 0.5
+
+def load_interactions(collection, value_field=None, batch_size=BATCH_SIZE):
+    """ Stream UserID, BookID and an optional value out of a collection into numpy arrays """
+    projection = {"_id": 0, "UserID": 1, "BookID": 1}
+    if value_field:
+        projection[value_field] = 1
+    users, books, values = array("q"), array("q"), array("d")
+    for document in collection.find({}, projection).batch_size(batch_size):
+        if document.get("UserID") is None or document.get("BookID") is None:
+            continue
+        users.append(int(document['UserID']))
+        books.append(int(document['BookID']))
+        if value_field:
+            values.append(float(document.get(value_field) or 0))
+    return (np.array(users, dtype=np.int64), np.array(books, dtype=np.int64),
+            np.array(values, dtype=np.float64) if value_field else None)
+
+def interaction_matrix(users, books, book_ids, values=None, centre=False):
+    """ Build a customers x books sparse matrix over the given sorted BookIDs
+
+    Repeated (customer, book) pairs are merged: purchases count once and ratings are averaged.
+    With centre, each customer's mean rating is subtracted so only relative preferences remain.
+    """
+    if not len(users):
+        return sparse.csr_matrix((0, len(book_ids)))
+    user_index = np.unique(users, return_inverse=True)[1]
+    pairs, pair_index = np.unique(user_index * len(book_ids) + np.searchsorted(book_ids, books),
+                                  return_inverse=True)
+    rows, columns = pairs // len(book_ids), pairs % len(book_ids)
+    if values is None:
+        data = np.ones(len(pairs))
+    else:
+        data = np.bincount(pair_index, weights=values) / np.bincount(pair_index)
+    if centre:
+        data -= (np.bincount(rows, weights=data) / np.bincount(rows))[rows]
+    matrix = sparse.csr_matrix((data, (rows, columns)), shape=(rows.max() + 1, len(book_ids)))
+    matrix.eliminate_zeros()
+    return matrix
+
+def _normalize_columns(matrix):
+    """ Scale every column to unit length, leaving empty columns empty """
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    return (matrix @ sparse.diags(inverse)).tocsc()
+
+def similar_books(weighted_matrices, top_k=TOP_K, block_size=BLOCK_SIZE):
+    """ Yield (book index, neighbour indices, scores) with each book's top_k most similar books
+
+    weighted_matrices is a list of (customers x books matrix, weight) over the same books; the
+    score is the weighted mean of their cosine similarities. Only positive scores are kept.
+    """
+    prepared = [(_normalize_columns(matrix), weight) for matrix, weight in weighted_matrices]
+    prepared = [(normalized.T.tocsr(), normalized, weight) for normalized, weight in prepared]
+    total_weight = sum(weight for _, _, weight in prepared)
+    book_count = prepared[0][1].shape[1]
+    for start in range(0, book_count, block_size):
+        stop = min(start + block_size, book_count)
+        # books x block similarities, sparse because most pairs of books share no customer
+        block = sum((left @ right[:, start:stop]) * (weight / total_weight) for left, right, weight in prepared)
+        block = sparse.csc_matrix(block)
+        for offset in range(stop - start):
+            first, last = block.indptr[offset], block.indptr[offset + 1]
+            neighbours, scores = block.indices[first:last], block.data[first:last]
+            keep = (neighbours != start + offset) & (scores > 0)
+            neighbours, scores = neighbours[keep], scores[keep]
+            if len(scores) > top_k:
+                best = np.argpartition(-scores, top_k)[:top_k]
+                neighbours, scores = neighbours[best], scores[best]
+            order = np.argsort(-scores, kind="stable")
+            yield start + offset, neighbours[order], scores[order]
+
+def build_recommendations(db, top_k=TOP_K, block_size=BLOCK_SIZE):
+    """ Recompute every book's neighbours and return how many books have recommendations """
+    purchase_users, purchase_books, _ = load_interactions(db["Orders"])
+    rating_users, rating_books, ratings = load_interactions(db["Reviews"], "Rating")
+    book_ids = np.unique(np.concatenate([purchase_books, rating_books]))
+
+    build = uuid.uuid4().hex
+    written, requests = 0, []
+    if len(book_ids):
+        matrices = [
+            (interaction_matrix(purchase_users, purchase_books, book_ids), PURCHASE_WEIGHT),
+            (interaction_matrix(rating_users, rating_books, book_ids, ratings, centre=True), RATING_WEIGHT),
+        ]
+        for index, neighbours, scores in similar_books(matrices, top_k, block_size):
+            if not len(neighbours):
+                continue
+            book_id = int(book_ids[index])
+            requests.append(ReplaceOne({"BookID": book_id}, {
+                "BookID": book_id,
+                "Neighbours": [int(book_ids[neighbour]) for neighbour in neighbours],
+                "Scores": [round(float(score), 4) for score in scores],
+                "Build": build,
+            }, upsert=True))
+            if len(requests) == WRITE_BATCH_SIZE:
+                db[RECOMMENDATIONS].bulk_write(requests, ordered=False)
+                written += len(requests)
+                requests = []
+    if requests:
+        db[RECOMMENDATIONS].bulk_write(requests, ordered=False)
+        written += len(requests)
+    # Books that lost every neighbour keep nothing from an earlier build
+    db[RECOMMENDATIONS].delete_many({"Build": {"$ne": build}})
+    return written
+
+if __name__ == "__main__":
+    from database import get_database
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top-k", type=int, default=TOP_K, help="neighbours kept per book")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE, help="books whose similarities are computed together")
+    args = parser.parse_args()
+    started = time.perf_counter()
+    built = build_recommendations(get_database(), args.top_k, args.block_size)
+    print(f"Built recommendations for {built} books in {time.perf_counter() - started:.1f}s")
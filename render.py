@@ -0,0 +1,173 @@
+""" Page CSS and memoized HTML for book and order cards
+
+Card markup is built once and reused by later reruns and other sessions. A book card is keyed
+by (BookID, version) and its rating summary. Every write that changes a book's card fields
+bumps the book's "version". An order card is keyed by (OrderID, OrderStatus) and the book
+title it shows, because the rest of an order never changes. The caches are process-wide and bounded.
+"""
+import html
+import re
+import threading
+from collections import OrderedDict
+
+from inventory import stock_label
+from ratings import rating_label
+
+# Cards kept per cache before the least recently used are dropped
+CARD_CACHE_SIZE = 10_000
+
+_STYLE = """
+    .book-card {
+        border: 2px solid #ccc;
+        border-radius: 10px;
+        padding: 20px;
+        margin: 10px;
+        box-shadow: 0 4px 8px rgba(0,0,0,0.1);
+    }
+    .book-title {
+        font-size: 1.5em;
+        font-weight: bold;
+    }
+    .book-details {
+        font-size: 1em;
+        margin-bottom: 10px;
+    }
+    .order-card {
+        border: 1px solid #ddd;
+        border-radius: 8px;
+        padding: 15px;
+        margin: 10px;
+        box-shadow: 0 4px 8px rgba(0,0,0,0.1);
+    }
+    .order-card h4 {
+        margin: 0 0 10px;
+    }
+    .order-card p {
+        margin: 5px 0;
+    }
+"""
+
+# The stylesheet, minified once at import
+CSS = "<style>" + re.sub(r"\s*([{}:;,])\s*", r"\1", " ".join(_STYLE.split())) + "</style>"
+
+BOOK_CARD_TEMPLATE = (
+    '<div class="book-card">'
+    '<div class="book-title">{title}</div>'
+    '<div class="book-details">Author: {author}</div>'
+    '<div class="book-details">Price: ${price}</div>'
+    '<div class="book-details">Genre: {genre}</div>'
+    '<div class="book-details">Published Year: {published_year}</div>'
+    '<div class="book-details">Publisher: {publisher}</div>'
+    '<div class="book-details">Rating: {rating}</div>'
+    '<div class="book-details">{stock}</div>'
+    '</div>'
+)
+
+ORDER_CARD_TEMPLATE = (
+    '<div class="order-card">'
+    '<h4>Order ID: {OrderID}</h4>'
+    '<p>{book}</p>'
+    '<p><strong>User ID:</strong> {UserID}</p>'
+    '<p><strong>Price:</strong> ${Price}</p>'
+    '<p><strong>Order Date:</strong> {OrderDate}</p>'
+    '<p><strong>Status:</strong> {OrderStatus}</p>'
+    '</div>'
+)
+
+ORDER_CARD_FIELDS = ("OrderID", "UserID", "Price", "OrderDate", "OrderStatus")
+
+REVIEW_CARD_TEMPLATE = (
+    '<div class="order-card">'
+    '<p><strong>Rating:</strong> {Rating}</p>'
+    '<p><strong>Comment:</strong> {Comment}</p>'
+    '<p><strong>Date:</strong> {ReviewDate}</p>'
+    '</div>'
+)
+
+REVIEW_CARD_FIELDS = ("Rating", "Comment", "ReviewDate")
+
+class CardCache:
+    """ Bounded least-recently-used map from card keys to rendered HTML """
+
+    def __init__(self, capacity=CARD_CACHE_SIZE):
+        self._capacity = capacity
+        self._cards = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key, render):
+        """ Return the cached HTML for a key, rendering and storing it on a miss """
+        with self._lock:
+            markup = self._cards.get(key)
+            if markup is not None:
+                self._cards.move_to_end(key)
+                self.hits += 1
+                return markup
+            self.misses += 1
+        markup = render()
+        with self._lock:
+            self._cards[key] = markup
+            while len(self._cards) > self._capacity:
+                self._cards.popitem(last=False)
+        return markup
+
+_book_cards = CardCache()
+_order_cards = CardCache()
+
+def _text(value):
+    """ Escape a field for HTML """
+    return html.escape(str(value))
+
+def _render_book_card(book, rating_summary):
+    return BOOK_CARD_TEMPLATE.format(
+        title=_text(book['title']),
+        author=_text(book['author']),
+        price=_text(book['price']),
+        genre=_text(book['genre']),
+        published_year=_text(book['published_year']),
+        publisher=_text(book['publisher']),
+        rating=_text(rating_label(rating_summary)),
+        stock=_text(stock_label(book)),
+    )
+
+def book_card_html(book, rating_summary=None):
+    """ Return the HTML card shown for a book in the browse, search and recommendation views """
+    rating = (rating_summary['count'], rating_summary['sum']) if rating_summary else None
+    key = (book['BookID'], book.get('version', 0), rating)
+    return _book_cards.get_or_render(key, lambda: _render_book_card(book, rating_summary))
+
+def _book_line(order, title):
+    """ Name the ordered book by title when it is known, otherwise by BookID """
+    if title:
+        return f"<strong>Book:</strong> {_text(title)}"
+    return f"<strong>Book ID:</strong> {_text(order.get('BookID', 'N/A'))}"
+
+def order_card_html(order, title=None):
+    """ Return the HTML card shown for an order, naming its book by title if given """
+    key = (order.get('OrderID'), order.get('OrderStatus'), title)
+    return _order_cards.get_or_render(key, lambda: ORDER_CARD_TEMPLATE.format(
+        book=_book_line(order, title),
+        **{field: _text(order.get(field, 'N/A')) for field in ORDER_CARD_FIELDS}
+    ))
+
+def order_cards_html(orders, titles=None):
+    """ Return the cards of many orders as one fragment, rendered with a single element """
+    titles = titles or {}
+    return "".join(order_card_html(order, titles.get(order.get('BookID'))) for order in orders)
+
+def review_cards_html(reviews):
+    """ Return the cards of a book's reviews as one fragment, with the customer's text escaped """
+    return "".join(
+        REVIEW_CARD_TEMPLATE.format(**{field: _text(review.get(field, 'N/A')) for field in REVIEW_CARD_FIELDS})
+        for review in reviews
+    )
+
+def card_cache_stats():
+    """ Return hit and miss counters of the book and order card caches """
+    return {
+        "book_hits": _book_cards.hits,
+        "book_misses": _book_cards.misses,
+        "order_hits": _order_cards.hits,
+        "order_misses": _order_cards.misses,
+    }
@@ -0,0 +1,76 @@
+""" In-process inverted index used to search the book catalog """
+import heapq
+import re
+from bisect import bisect_left
+
+# Book fields that can be searched from the customer dashboard
+SEARCH_FIELDS = ("title", "genre", "author", "publisher")
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text):
+    """ Split text into lowercase word tokens """
+    return _TOKEN_PATTERN.findall(str(text).lower())
+
+def build_search_index(books):
+    """ Build a token -> book positions map and a sorted token list for each searchable field """
+    fields = {}
+    for field in SEARCH_FIELDS:
+        postings = {}
+        normalized = []
+        for position, book in enumerate(books):
+            tokens = tokenize(book.get(field, ""))
+            normalized.append(" ".join(tokens))
+            for token in set(tokens):
+                postings.setdefault(token, []).append(position)
+        fields[field] = {"postings": postings, "tokens": sorted(postings), "normalized": normalized}
+    return {"books": books, "fields": fields}
+
+def _score_term(field_index, term):
+    """ Score books for one query term: 2 for a whole-word match, 1 for a prefix match """
+    postings = field_index['postings']
+    tokens = field_index['tokens']
+    scores = {}
+    position = bisect_left(tokens, term)
+    while position < len(tokens) and tokens[position].startswith(term):
+        token = tokens[position]
+        score = 2 if token == term else 1
+        for book_position in postings[token]:
+            if scores.get(book_position, 0) < score:
+                scores[book_position] = score
+        position += 1
+    return scores
+
+def search_index(index, search_term, search_by, limit=None):
+    """ Return books whose search_by field contains every term as a word or word prefix, best matches first """
+    terms = tokenize(search_term)
+    field_index = index['fields'].get(search_by)
+    if not terms or field_index is None:
+        return []
+
+    scores = None
+    for term in terms:
+        term_scores = _score_term(field_index, term)
+        if scores is None:
+            scores = term_scores
+        else:
+            scores = {pos: scores[pos] + score for pos, score in term_scores.items() if pos in scores}
+        if not scores:
+            return []
+
+    books = index['books']
+    normalized = field_index['normalized']
+    wanted = " ".join(terms)
+    for position in scores:
+        # Rank an exact match on the whole field above partial matches
+        if normalized[position] == wanted:
+            scores[position] += 1
+
+    def rank(position):
+        return (-scores[position], index['fields']['title']['normalized'][position])
+
+    if limit is None:
+        ranked = sorted(scores, key=rank)
+    else:
+        ranked = heapq.nsmallest(limit, scores, key=rank)
+    return [books[position] for position in ranked]
@@ -0,0 +1,480 @@
+""" Bookstore data operations, kept free of Streamlit so they can be reused and benchmarked
+
+Every function takes the database as its first argument. final.py wraps these with the
+widgets, messages and cache invalidation of the web interface.
+"""
+from datetime import date
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from analytics import ROLLUPS, rebuild_sales, record_sales, record_status_change
+from inventory import BACKORDERED, PROCESSING, release_stock, reserve_stock
+from ratings import rebuild_ratings, record_rating
+from search import search_index
+
+# Collections whose integer IDs are allocated from the Counters collection
+ID_FIELDS = {"Books": "BookID", "Orders": "OrderID", "Reviews": "ReviewID"}
+
+# Secondary indexes backing the app's queries, as (collection, keys, options)
+INDEXES = [
+    ("Users", [("UserID", ASCENDING), ("UserType", ASCENDING)], {"unique": True}),
+    ("Books", [("title", ASCENDING)], {}),
+    # Browsing pages through active books in BookID order
+    ("Books", [("active", ASCENDING), ("BookID", ASCENDING)], {}),
+    ("Reviews", [("BookID", ASCENDING), ("ReviewDate", DESCENDING)], {}),
+    ("Orders", [("OrderStatus", ASCENDING), ("OrderDate", DESCENDING)], {}),
+    # A customer's order history, newest first, with OrderID breaking ties within a day
+    ("Orders", [("UserID", ASCENDING), ("OrderDate", DESCENDING), ("OrderID", DESCENDING)], {}),
+    ("Orders", [("BookID", ASCENDING), ("OrderDate", DESCENDING)], {}),
+    # Per-title backorder queue, oldest first
+    ("Orders", [("BookID", ASCENDING), ("OrderStatus", ASCENDING), ("OrderID", ASCENDING)], {}),
+    # Orders placed before idempotency keys existed have none, hence sparse
+    ("Orders", [("IdempotencyKey", ASCENDING)], {"unique": True, "sparse": True}),
+    ("Ratings", [("BookID", ASCENDING)], {"unique": True}),
+    ("Ratings", [("average", DESCENDING)], {}),
+    (ROLLUPS, [("Dimension", ASCENDING), ("Key", ASCENDING)], {"unique": True}),
+    (ROLLUPS, [("Dimension", ASCENDING), ("Revenue", DESCENDING)], {}),
+    ("Recommendations", [("BookID", ASCENDING)], {"unique": True}),
+]
+
+# Filter for books that have not been soft-deleted
+ACTIVE_BOOKS = {"active": True}
+
+# Profile fields kept in session state after login
+PROFILE_FIELDS = {"_id": 0, "UserID": 1, "Username": 1, "Email": 1, "UserType": 1}
+
+# Number of book cards shown per page of the browse view
+BOOKS_PER_PAGE = 12
+
+# Only the fields rendered on a book card are fetched for the browse view
+BOOK_CARD_FIELDS = {"_id": 0, "BookID": 1, "title": 1, "author": 1, "price": 1,
+                    "genre": 1, "published_year": 1, "publisher": 1, "stock": 1, "version": 1}
+
+# Fields that change as a book sells; cards built from a cached snapshot read them live
+STOCK_FIELDS = {"_id": 0, "BookID": 1, "stock": 1, "version": 1}
+
+# Maximum number of ranked search results rendered at once
+SEARCH_RESULT_LIMIT = 48
+
+# Number of books per page of the reviews view, and reviews shown for each book
+REVIEW_BOOKS_PER_PAGE = 10
+REVIEWS_PER_BOOK = 5
+
+# Number of orders per page of the admin order view
+ORDERS_PER_PAGE = 20
+
+# Number of orders loaded at a time in a customer's order history
+USER_ORDERS_PER_PAGE = 10
+
+# Only the fields rendered on an order card are fetched for the order history
+ORDER_CARD_FIELDS = {"_id": 0, "OrderID": 1, "UserID": 1, "BookID": 1, "Price": 1, "OrderDate": 1,
+                     "OrderStatus": 1}
+
+# Number of "readers also bought" books shown to a customer
+RECOMMENDATIONS_SHOWN = 6
+
+def _has_unique_index(collection, field):
+    """ Check whether a collection already has a unique index on the field alone """
+    return any(index.get('unique') and index['key'] == [(field, ASCENDING)]
+               for index in collection.index_information().values())
+
+def renumber_duplicate_ids(db, name, field):
+    """ Give fresh IDs to documents sharing an ID, or having none, and return their (old, new) IDs
+
+    IDs handed out as count + 1 could repeat. The oldest document keeps each repeated ID, so
+    orders and reviews that reference a repeated BookID keep pointing at the original book.
+    """
+    renumbered = []
+    duplicates = db[name].aggregate([
+        {"$group": {"_id": f"${field}", "documents": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"$or": [{"count": {"$gt": 1}}, {"_id": None}]}}
+    ])
+    for group in duplicates:
+        documents = sorted(group['documents'])
+        # Documents without an ID all need one
+        if group['_id'] is not None:
+            documents = documents[1:]
+        first_id = reserve_ids(db, name, len(documents))
+        for offset, document_id in enumerate(documents):
+            db[name].update_one({"_id": document_id}, {"$set": {field: first_id + offset}})
+            renumbered.append((group['_id'], first_id + offset))
+    return renumbered
+
+def setup_database(db):
+    """ Create indexes and seed each ID counter with the highest existing ID
+
+    Returns a collection -> [(old ID, new ID)] map of documents renumbered because their ID
+    was repeated, which would otherwise keep the unique ID index from being built.
+    """
+    for name, keys, options in INDEXES:
+        db[name].create_index(keys, **options)
+    renumbered = {}
+    for name, field in ID_FIELDS.items():
+        highest = db[name].find_one({}, {field: 1}, sort=[(field, DESCENDING)])
+        # $max keeps the counter monotonic if several processes seed at once
+        db["Counters"].update_one(
+            {"_id": name},
+            {"$max": {"seq": highest[field] if highest and highest.get(field) is not None else 0}},
+            upsert=True
+        )
+        if not _has_unique_index(db[name], field):
+            changed = renumber_duplicate_ids(db, name, field)
+            if changed:
+                renumbered[name] = changed
+            db[name].create_index([(field, ASCENDING)], unique=True)
+    # Books stored before soft-delete existed are active
+    db["Books"].update_many({"active": {"$exists": False}}, {"$set": {"active": True}})
+    # Materialize rating summaries the first time the app meets an existing dataset
+    if db["Ratings"].find_one() is None and db["Reviews"].find_one() is not None:
+        rebuild_ratings(db)
+    if db[ROLLUPS].find_one() is None and db["Orders"].find_one() is not None:
+        rebuild_sales(db)
+    return renumbered
+
+def reserve_ids(db, name, count):
+    """ Atomically reserve a block of consecutive integer IDs and return the first one """
+    counter = db["Counters"].find_one_and_update(
+        {"_id": name},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter['seq'] - count + 1
+
+def next_id(db, name):
+    """ Atomically allocate the next integer ID for the given collection """
+    return reserve_ids(db, name, 1)
+
+def today():
+    """ Return today's date in the YYYY-MM-DD form stored on orders and reviews """
+    return date.today().strftime('%Y-%m-%d')
+
+def authenticate_user(db, user_id, user_type):
+    """ Return the profile of the user with this ID and type, or None """
+    return db["Users"].find_one({"UserID": int(user_id), "UserType": user_type}, PROFILE_FIELDS)
+
+def user_exists(db, user_id):
+    """ Check whether any account already uses this ID """
+    return db["Users"].find_one({"UserID": int(user_id)}, {"_id": 1}) is not None
+
+def create_user(db, user_type, name, email, user_id):
+    """ Insert a new customer or admin account and return it """
+    new_user = {
+        "UserID": int(user_id),
+        "Username": name,
+        "Email": email,
+        "UserType": user_type
+    }
+    db["Users"].insert_one(new_user)
+    new_user.pop('_id', None)
+    return new_user
+
+def update_profile(db, user_id, user_type, name, email):
+    """ Update a user's name and email """
+    db["Users"].update_one(
+        {"UserID": int(user_id), "UserType": user_type},
+        {"$set": {"Username": name, "Email": email}}
+    )
+
+def fetch_books_page(db, after_book_id=None, limit=BOOKS_PER_PAGE):
+    """ Fetch one page of books ordered by BookID, starting after the given BookID """
+    query = dict(ACTIVE_BOOKS)
+    if after_book_id is not None:
+        query["BookID"] = {"$gt": after_book_id}
+    # One extra document tells us whether a next page exists
+    cursor = db["Books"].find(query, BOOK_CARD_FIELDS).sort("BookID", 1).limit(limit + 1)
+    books = list(cursor)
+    return books[:limit], len(books) > limit
+
+def search_books(index, search_term, search_by, sort_by="relevance", ratings=None, limit=SEARCH_RESULT_LIMIT):
+    """ Search a prebuilt catalog index, ranked by relevance or by average rating """
+    if sort_by == "rating":
+        ratings = ratings or {}
+        results = search_index(index, search_term, search_by)
+        results.sort(key=lambda book: -ratings.get(book['BookID'], {}).get('average', 0))
+        return results[:limit]
+    return search_index(index, search_term, search_by, limit=limit)
+
+def add_book(db, title, author, price, genre, published_year, publisher):
+    """ Insert a new book and return it, raising ValueError if the title is taken """
+    if db["Books"].find_one({"title": title, **ACTIVE_BOOKS}, {"_id": 1}):
+        raise ValueError("A book with this title already exists!")
+    new_book = {
+        "BookID": next_id(db, "Books"),
+        "title": title,
+        "author": author,
+        "price": price,
+        "genre": genre,
+        "published_year": int(published_year),
+        "publisher": publisher,
+        "active": True,
+        "version": 1
+    }
+    db["Books"].insert_one(new_book)
+    new_book.pop('_id', None)
+    return new_book
+
+def delete_books(db, book_ids, deleted_on=None):
+    """ Soft-delete many books in one update and return how many were deleted
+
+    The documents stay in Books so orders and sales history still resolve; cleanup.py removes
+    the reviews, ratings and recommendations of deleted books.
+    """
+    return db["Books"].update_many(
+        {"BookID": {"$in": list(book_ids)}, **ACTIVE_BOOKS},
+        {"$set": {"active": False, "deleted_on": deleted_on or today()}}
+    ).modified_count
+
+def new_order(order_id, user_id, book_id, price, idempotency_key=None, status=PROCESSING):
+    """ Build an order document, tagged with the idempotency key of the click that placed it """
+    order = {
+        "OrderID": order_id,
+        "UserID": int(user_id),
+        "OrderDate": today(),
+        "BookID": book_id,
+        "Price": price,
+        "OrderStatus": status
+    }
+    if idempotency_key is not None:
+        order["IdempotencyKey"] = idempotency_key
+    return order
+
+def order_book(db, user_id, book_id, price, idempotency_key=None):
+    """ Place an order for a book and return it; retrying with the same key returns the first order
+
+    The order reserves one unit of stock, or is stored as Backordered if the title is sold out.
+    Raises ValueError if the book was deleted or does not exist.
+    """
+    if not db["Books"].find_one({"BookID": book_id, **ACTIVE_BOOKS}, {"_id": 1}):
+        # A retry of an order placed before the book was deleted still returns that order
+        placed = db["Orders"].find_one({"IdempotencyKey": idempotency_key}, {"_id": 0}) if idempotency_key else None
+        if placed:
+            return placed
+        raise ValueError("This book is no longer available")
+    order_id = next_id(db, "Orders")
+    reserved = reserve_stock(db, book_id)
+    order = new_order(order_id, user_id, book_id, price, idempotency_key, PROCESSING if reserved else BACKORDERED)
+    try:
+        db["Orders"].insert_one(order)
+    except DuplicateKeyError:
+        release_stock(db, {book_id: reserved})
+        if idempotency_key is None:
+            raise
+        return db["Orders"].find_one({"IdempotencyKey": idempotency_key}, {"_id": 0})
+    except Exception:
+        release_stock(db, {book_id: reserved})
+        raise
+    record_sales(db, [order])
+    order.pop('_id', None)
+    return order
+
+def _reserved_units(orders):
+    """ Count the stock units held by Processing orders, as a BookID -> units map """
+    units = {}
+    for order in orders:
+        if order['OrderStatus'] == PROCESSING:
+            units[order['BookID']] = units.get(order['BookID'], 0) + 1
+    return units
+
+def place_orders(db, requests):
+    """ Insert a batch of order requests idempotently and return an IdempotencyKey -> order map
+
+    Each request is a dict with user_id, book_id, price and key. Each mapped order holds its
+    OrderID and OrderStatus, which is Backordered when the title was sold out. Requests for
+    deleted or unknown books are not stored and have no entry, unless an earlier attempt placed them.
+    """
+    keys = [request['key'] for request in requests]
+    wanted = {}
+    for request in requests:
+        wanted[request['book_id']] = wanted.get(request['book_id'], 0) + 1
+    orderable = set(db["Books"].distinct("BookID", {"BookID": {"$in": list(wanted)}, **ACTIVE_BOOKS}))
+    requests = [request for request in requests if request['book_id'] in orderable]
+    wanted = {book_id: count for book_id, count in wanted.items() if book_id in orderable}
+    if not requests:
+        return _placed_orders(db, keys)
+
+    first_id = reserve_ids(db, "Orders", len(requests))
+    # Reserve stock once per title; the earliest requests get the units that are left
+    available = {book_id: reserve_stock(db, book_id, count) for book_id, count in wanted.items()}
+
+    orders = []
+    for offset, request in enumerate(requests):
+        in_stock = available[request['book_id']] > 0
+        if in_stock:
+            available[request['book_id']] -= 1
+        orders.append(new_order(first_id + offset, request['user_id'], request['book_id'], request['price'],
+                                request['key'], PROCESSING if in_stock else BACKORDERED))
+    try:
+        db["Orders"].insert_many(orders, ordered=False)
+    except BulkWriteError as error:
+        # Orders that were not inserted give back their stock, whatever the reason
+        failed = {write_error['index'] for write_error in error.details['writeErrors']}
+        release_stock(db, _reserved_units(orders[index] for index in failed))
+        record_sales(db, [order for index, order in enumerate(orders) if index not in failed])
+        # A duplicate key means an earlier attempt already placed that order; anything else is a real failure
+        if any(write_error['code'] != 11000 for write_error in error.details['writeErrors']):
+            raise
+    except Exception:
+        release_stock(db, _reserved_units(orders))
+        raise
+    else:
+        record_sales(db, orders)
+    return _placed_orders(db, keys)
+
+def _placed_orders(db, keys):
+    """ Return an IdempotencyKey -> {OrderID, OrderStatus} map of the stored orders among keys """
+    placed = db["Orders"].find({"IdempotencyKey": {"$in": keys}},
+                               {"_id": 0, "IdempotencyKey": 1, "OrderID": 1, "OrderStatus": 1})
+    return {order.pop('IdempotencyKey'): order for order in placed}
+
+def with_live_stock(db, books):
+    """ Return copies of the given books with their current stock and version, in one query """
+    if not books:
+        return []
+    live = {book['BookID']: book
+            for book in db["Books"].find({"BookID": {"$in": [book['BookID'] for book in books]}}, STOCK_FIELDS)}
+    fresh = []
+    for book in books:
+        book = {field: value for field, value in book.items() if field not in ("stock", "version")}
+        book.update(live.get(book['BookID'], {}))
+        fresh.append(book)
+    return fresh
+
+def fetch_recommendations(db, user_id, limit=RECOMMENDATIONS_SHOWN):
+    """ Return the customer's latest ordered book and the books its readers also bought
+
+    Neighbours are precomputed by recommend.py. Returns (None, []) for a customer without orders.
+    """
+    latest = db["Orders"].find_one({"UserID": int(user_id)}, {"_id": 0, "BookID": 1},
+                                   sort=[("OrderDate", DESCENDING), ("OrderID", DESCENDING)])
+    if latest is None:
+        return None, []
+    entry = db["Recommendations"].find_one({"BookID": latest['BookID']}, {"_id": 0, "Neighbours": 1})
+    neighbours = entry['Neighbours'][:limit] if entry else []
+    books = {
+        book['BookID']: book
+        for book in db["Books"].find({"BookID": {"$in": [latest['BookID']] + neighbours}, **ACTIVE_BOOKS},
+                                     BOOK_CARD_FIELDS)
+    }
+    return books.get(latest['BookID']), [books[book_id] for book_id in neighbours if book_id in books]
+
+def build_order_query(statuses=None, date_range=None, user_id=None, book_id=None):
+    """ Build the Orders filter for the admin view """
+    query = {}
+    if statuses:
+        query["OrderStatus"] = {"$in": list(statuses)}
+    if date_range:
+        # OrderDate is stored as YYYY-MM-DD, so string comparison orders dates correctly
+        query["OrderDate"] = {"$gte": date_range[0].strftime('%Y-%m-%d')}
+        if len(date_range) > 1:
+            query["OrderDate"]["$lte"] = date_range[1].strftime('%Y-%m-%d')
+    if user_id is not None:
+        query["UserID"] = user_id
+    if book_id is not None:
+        query["BookID"] = book_id
+    return query
+
+def fetch_orders_page(db, query, sort, page, per_page=ORDERS_PER_PAGE):
+    """ Fetch one page of orders matching the query in the given sort order """
+    cursor = db["Orders"].find(query, {"_id": 0}).sort(sort).skip(page * per_page).limit(per_page + 1)
+    orders = list(cursor)
+    return orders[:per_page], len(orders) > per_page
+
+def update_order_status(db, query, new_status):
+    """ Move every order matching the query to the new status and return how many moved
+
+    Backordered orders hold no stock, so each one only moves once a unit is reserved for it,
+    oldest first; the rest stay Backordered. Orders are never backordered by hand.
+    """
+    if new_status == BACKORDERED:
+        raise ValueError("Orders are only backordered when their book is sold out")
+    query = {"$and": [query, {"OrderStatus": {"$ne": new_status}}]}
+    waiting = {}
+    for order in db["Orders"].find({"$and": [query, {"OrderStatus": BACKORDERED}]},
+                                   {"_id": 0, "OrderID": 1, "BookID": 1}).sort("OrderID", ASCENDING):
+        waiting.setdefault(order['BookID'], []).append(order['OrderID'])
+
+    held = {"$and": [query, {"OrderStatus": {"$ne": BACKORDERED}}]}
+    moved = {row['_id']: row['orders'] for row in db["Orders"].aggregate([
+        {"$match": held},
+        {"$group": {"_id": "$OrderStatus", "orders": {"$sum": 1}}}
+    ])}
+    updated = db["Orders"].update_many(held, {"$set": {"OrderStatus": new_status}}).modified_count
+
+    fulfilled = 0
+    for book_id, order_ids in waiting.items():
+        reserved = reserve_stock(db, book_id, len(order_ids))
+        released = db["Orders"].update_many(
+            {"OrderID": {"$in": order_ids[:reserved]}, "OrderStatus": BACKORDERED},
+            {"$set": {"OrderStatus": new_status}}
+        ).modified_count
+        # A restock may have fulfilled some of these orders first, and they already hold a unit
+        release_stock(db, {book_id: reserved - released})
+        fulfilled += released
+    moved[BACKORDERED] = fulfilled
+    record_status_change(db, moved, new_status)
+    return updated + fulfilled
+
+def fetch_user_orders(db, user_id, after=None, limit=USER_ORDERS_PER_PAGE):
+    """ Fetch a customer's orders newest first, starting after the given (OrderDate, OrderID) """
+    query = {"UserID": int(user_id)}
+    if after is not None:
+        order_date, order_id = after
+        query["$or"] = [
+            {"OrderDate": {"$lt": order_date}},
+            {"OrderDate": order_date, "OrderID": {"$lt": order_id}},
+        ]
+    # One extra document tells us whether more orders exist
+    cursor = db["Orders"].find(query, ORDER_CARD_FIELDS).sort(
+        [("OrderDate", DESCENDING), ("OrderID", DESCENDING)]
+    ).limit(limit + 1)
+    orders = list(cursor)
+    return orders[:limit], len(orders) > limit
+
+def fetch_book_titles(db, book_ids):
+    """ Return a BookID -> title map for the given books, deleted ones included, in one query """
+    return {
+        book['BookID']: book['title']
+        for book in db["Books"].find({"BookID": {"$in": list(book_ids)}}, {"_id": 0, "BookID": 1, "title": 1})
+    }
+
+def fetch_review_groups(db, page, books_per_page=REVIEW_BOOKS_PER_PAGE):
+    """ Fetch one page of reviewed books with title, rating summary and latest reviews """
+    pipeline = [
+        {"$sort": {"BookID": 1}},
+        {"$lookup": {"from": "Books", "localField": "BookID", "foreignField": "BookID", "as": "book"}},
+        # Skip summaries whose book was deleted or no longer exists
+        {"$match": {"book.active": True}},
+        {"$skip": page * books_per_page},
+        # One extra summary tells us whether a next page exists
+        {"$limit": books_per_page + 1},
+        {"$project": {"_id": 0, "BookID": 1, "average": 1, "count": 1,
+                      "title": {"$arrayElemAt": ["$book.title", 0]}}}
+    ]
+    groups = list(db["Ratings"].aggregate(pipeline))
+    has_next = len(groups) > books_per_page
+    groups = groups[:books_per_page]
+
+    # Each book reads only its newest reviews off the (BookID, ReviewDate) index, so a page costs
+    # the same however many reviews its books have
+    for group in groups:
+        group['reviews'] = list(db["Reviews"].find(
+            {"BookID": group['BookID']}, {"_id": 0, "Rating": 1, "Comment": 1, "ReviewDate": 1}
+        ).sort("ReviewDate", DESCENDING).limit(REVIEWS_PER_BOOK))
+    return groups, has_next
+
+def add_review(db, user_id, book_id, rating, comment):
+    """ Insert a review, fold its rating into the book's summary and return it """
+    new_review = {
+        "ReviewID": next_id(db, "Reviews"),
+        "BookID": book_id,
+        "UserID": int(user_id),
+        "Rating": rating,
+        "Comment": comment,
+        "ReviewDate": today()
+    }
+    db["Reviews"].insert_one(new_review)
+    record_rating(db["Ratings"], book_id, rating)
+    new_review.pop('_id', None)
+    return new_review